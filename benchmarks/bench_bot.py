@@ -0,0 +1,256 @@
+"""Нагрузочный тест обработчиков bot.py без настоящего Telegram и Google Sheets.
+
+Бот работает против локального FakeTelegram (через telebot.apihelper.API_URL)
+и FakeSheets с синтетическим листом, виртуальные пользователи параллельно
+проходят диалоги. Для каждого шага считаются p50/p99 времени от поступления
+обновления до конца его обработки, общая пропускная способность и память.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_bot --users 300 --concurrency 50
+    python -m benchmarks.bench_bot --flows teacher_day,teacher_week --telegram-latency 0.02
+    python -m benchmarks.bench_bot --transport polling --broadcast
+"""
+import argparse
+import configparser
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import telebot  # noqa: E402
+from telebot import types  # noqa: E402
+
+from benchmarks.fake_sheets import FakeSheets  # noqa: E402
+from benchmarks.fake_telegram import FakeTelegram  # noqa: E402
+from benchmarks.fixtures import course_labels, make_grid, surnames  # noqa: E402
+
+FLOWS = ["student_day", "student_week", "teacher_day", "teacher_week", "inline_group", "inline_teacher"]
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Harness:
+    """Окружение бенчмарка: временный каталог, фейковые API и импортированный bot."""
+
+    def __init__(self, args):
+        self.args = args
+        self.workdir = tempfile.mkdtemp(prefix="bot-bench-")
+        self.telegram = FakeTelegram(latency=args.telegram_latency).start()
+        telebot.apihelper.API_URL = self.telegram.api_url
+        self._prepare_workdir()
+        os.chdir(self.workdir)
+
+        import bot
+        self.bot = bot
+        self.sheets = FakeSheets(make_grid(groups_per_course=args.groups_per_course), latency=args.sheets_latency)
+        bot.sheet = self.sheets
+
+        self.finished = {}  # update_id -> threading.Event
+        self._lock = threading.Lock()
+        self._update_id = 0
+        process = bot.dispatcher.process
+
+        def tracked_process(updates):
+            try:
+                process(updates)
+            finally:
+                for update in updates:
+                    self._event(update.update_id).set()
+
+        bot.dispatcher.process = tracked_process
+        if args.processes > 1:
+            # Обновления обрабатываются в процессах-обработчиках, они сообщают о завершении сами
+            self.submit = bot.start_processing(on_done=lambda update_id: self._event(update_id).set())
+        elif args.transport == "polling":
+            threading.Thread(target=bot.run_polling, name="bench-polling", daemon=True).start()
+        else:
+            self.submit = bot.start_processing()
+
+    def _prepare_workdir(self):
+        config = configparser.ConfigParser()
+        config.read(os.path.join(ROOT, 'config.ini'))
+        config['Bot']['workers'] = str(self.args.workers)
+        config['Broadcast']['global_rate'] = str(self.args.broadcast_rate)
+        config['Bot']['processes'] = str(self.args.processes)
+        config['Bot']['api_url'] = self.telegram.api_url
+        with open(os.path.join(self.workdir, 'config.ini'), 'w') as f:
+            config.write(f)
+        os.symlink(os.path.join(ROOT, 'BOT.json'), os.path.join(self.workdir, 'BOT.json'))
+
+    def close(self):
+        for pool in self.bot.worker_pools:
+            pool.stop()
+        self.telegram.stop()
+        os.chdir(ROOT)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def _event(self, update_id):
+        with self._lock:
+            return self.finished.setdefault(update_id, threading.Event())
+
+    def _next_id(self):
+        with self._lock:
+            self._update_id += 1
+            return self._update_id
+
+    def send(self, update):
+        """Отправка обновления боту и ожидание конца его обработки. Возвращает задержку."""
+        started = time.perf_counter()
+        if self.args.transport == "polling":
+            update = self.telegram.push(update)
+        else:
+            update["update_id"] = self._next_id()
+            self.submit(types.Update.de_json(update))
+        if not self._event(update["update_id"]).wait(60):
+            raise TimeoutError(f"Обновление {update['update_id']} не обработано за 60 с")
+        return time.perf_counter() - started
+
+    @staticmethod
+    def message(chat_id, text):
+        user = {"id": chat_id, "is_bot": False, "first_name": "Bench", "username": f"user{chat_id}"}
+        return {"message": {
+            "message_id": random.randint(1, 10 ** 9), "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "from": user, "text": text
+        }}
+
+    @staticmethod
+    def callback(chat_id, data):
+        user = {"id": chat_id, "is_bot": False, "first_name": "Bench"}
+        return {"callback_query": {
+            "id": str(random.randint(1, 10 ** 9)), "from": user, "chat_instance": str(chat_id), "data": data,
+            "message": {"message_id": 1, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}, "text": "."}
+        }}
+
+    @staticmethod
+    def inline_query(chat_id, query):
+        user = {"id": chat_id, "is_bot": False, "first_name": "Bench"}
+        return {"inline_query": {"id": str(random.randint(1, 10 ** 9)), "from": user, "query": query, "offset": ""}}
+
+
+def flow_steps(harness, flow, rnd):
+    """Шаги диалога: список (имя шага, обновление без chat_id)."""
+    schedule = harness.bot.get_schedule()
+    course = rnd.randrange(len(course_labels))
+    groups = schedule.groups_for_course(course_labels[course]) or [(0, "")]
+    group_col = str(rnd.choice(groups)[0])
+    day = rnd.choice(harness.bot.days_for_first_course)
+    surname = rnd.choice(surnames)
+    if flow == "student_day":
+        return [("start", "/start"), ("role", "Студент🧑‍🎓"), ("course", f"{course + 1} курс"),
+                ("choice", "На один день"), ("day", day), ("group", ("callback", group_col))]
+    if flow == "student_week":
+        return [("start", "/start"), ("role", "Студент🧑‍🎓"), ("course", f"{course + 1} курс"),
+                ("choice", "На всю неделю"), ("group_week", ("callback", group_col))]
+    if flow == "teacher_day":
+        return [("start", "/start"), ("role", "Преподаватель👨‍🏫"), ("choice", "На один день"),
+                ("day", day), ("teacher", surname)]
+    if flow == "inline_group":
+        return [("query", ("inline_query", f"{schedule.groups.get(int(group_col), '')} {day}"))]
+    if flow == "inline_teacher":
+        return [("query", ("inline_query", f"{surname} {day}"))]
+    return [("start", "/start"), ("role", "Преподаватель👨‍🏫"), ("choice", "На всю неделю"), ("teacher_week", surname)]
+
+
+def run_user(harness, chat_id, flows, latencies, lock):
+    rnd = random.Random(chat_id)
+    flow = rnd.choice(flows)
+    for step, payload in flow_steps(harness, flow, rnd):
+        if isinstance(payload, tuple):
+            update = getattr(harness, payload[0])(chat_id, payload[1])
+        else:
+            update = harness.message(chat_id, payload)
+        elapsed = harness.send(update)
+        with lock:
+            latencies.setdefault(f"{flow}.{step}", []).append(elapsed)
+            latencies.setdefault("all", []).append(elapsed)
+
+
+def run_broadcast(harness):
+    """Рассылка всем пользователям от имени администратора, возвращает (время, число сообщений, число получателей)."""
+    bot = harness.bot
+    recipients = bot.user_store.count()
+    sent_before = len(harness.telegram.sent)
+    started = time.perf_counter()
+    harness.send(harness.message(bot.ADMIN_ID, "/otvet"))
+    harness.send(harness.message(bot.ADMIN_ID, "Тестовая рассылка"))
+    while os.path.exists(bot.BROADCAST_STATE_FILE):
+        time.sleep(0.05)
+    return time.perf_counter() - started, len(harness.telegram.sent) - sent_before, recipients
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=200, help="число виртуальных пользователей")
+    parser.add_argument('--concurrency', type=int, default=50, help="сколько пользователей ведут диалог одновременно")
+    parser.add_argument('--flows', default=",".join(FLOWS), help="сценарии через запятую: " + ", ".join(FLOWS))
+    parser.add_argument('--transport', choices=["direct", "polling"], default="direct",
+                        help="direct — обновления сразу в диспетчер, polling — через getUpdates")
+    parser.add_argument('--workers', type=int, default=4, help="потоки диспетчера бота (в каждом процессе)")
+    parser.add_argument('--processes', type=int, default=1, help="процессы-обработчики, больше 1 — только с --transport direct")
+    parser.add_argument('--groups-per-course', type=int, default=17)
+    parser.add_argument('--telegram-latency', type=float, default=0.0, help="задержка ответа Telegram, с")
+    parser.add_argument('--sheets-latency', type=float, default=0.0, help="задержка ответа Sheets, с")
+    parser.add_argument('--broadcast', action='store_true', help="после диалогов выполнить рассылку /otvet")
+    parser.add_argument('--broadcast-rate', type=float, default=1000, help="лимит рассылки, сообщений в секунду")
+    parser.add_argument('--blocked-share', type=float, default=0.0, help="доля пользователей, заблокировавших бота")
+    parser.add_argument('--tracemalloc', action='store_true', help="считать пик памяти Python через tracemalloc")
+    args = parser.parse_args()
+
+    if args.processes > 1 and args.transport == "polling":
+        parser.error("--processes больше 1 поддерживается только с --transport direct")
+    flows = [flow.strip() for flow in args.flows.split(',') if flow.strip()]
+    if args.tracemalloc:
+        tracemalloc.start()
+    harness = Harness(args)
+    try:
+        chat_ids = [100000 + n for n in range(args.users)]
+        harness.bot.get_schedule()  # первая загрузка листа не входит в замер
+
+        latencies = {}
+        lock = threading.Lock()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for future in [executor.submit(run_user, harness, chat_id, flows, latencies, lock) for chat_id in chat_ids]:
+                future.result()
+        elapsed = time.perf_counter() - started
+
+        print(f"Пользователей: {args.users}, одновременно: {args.concurrency}, потоков бота: {args.workers}, "
+              f"процессов: {args.processes}, транспорт: {args.transport}")
+        print(f"{'шаг':32} {'n':>6} {'p50, мс':>9} {'p99, мс':>9}")
+        for step in sorted(latencies):
+            values = latencies[step]
+            print(f"{step:32} {len(values):6d} {percentile(values, 0.5) * 1000:9.1f} {percentile(values, 0.99) * 1000:9.1f}")
+        print(f"Обновлений в секунду: {len(latencies['all']) / elapsed:.1f}")
+        print(f"Вызовов Telegram API: {sum(harness.telegram.calls.values())}, запросов к Sheets: {harness.sheets.calls}")
+        print(f"Кэш ответов: {harness.bot.render_cache.stats()}")
+
+        if args.broadcast:
+            harness.telegram.blocked = {str(chat_id) for chat_id in chat_ids if random.random() < args.blocked_share}
+            broadcast_time, sent, recipients = run_broadcast(harness)
+            print(f"Рассылка: {recipients} получателей, {sent} сообщений за {broadcast_time:.2f} с "
+                  f"({recipients / broadcast_time:.1f} получателей/с)")
+
+        print(f"Пик RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} МБ")
+        if args.tracemalloc:
+            print(f"Пик памяти Python (tracemalloc): {tracemalloc.get_traced_memory()[1] / 1024 / 1024:.1f} МБ")
+    finally:
+        harness.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Сравнение памяти: лист как список списков строк и как SheetGrid, пары как
+namedtuple со своими строками и как Lesson со строками из таблицы строк.
+
+Каждая копия листа проходит через JSON, как ответ Google API, поэтому у
+каждой ячейки свой объект str — так лист лежит в кэше, если хранить его
+списками. Копий несколько: семестры, несколько таблиц (текущая и
+предыдущая для /rollback) и прежняя ревизия на время сравнения. Память
+считается через tracemalloc по живым объектам, время — на чтение всех
+ячеек листа и построение Schedule.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_memory --copies 6
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fixtures import make_grid  # noqa: E402
+from schedule import Schedule  # noqa: E402
+from sheet_grid import SheetGrid  # noqa: E402
+
+# Пара в прежнем виде: кортеж, предмет, ФИО и кабинет у каждой пары свои
+LegacyLesson = namedtuple('LegacyLesson', ['group_col', 'group', 'day', 'pair', 'time', 'subject', 'teacher', 'cabinet'])
+
+
+def api_rows(grid):
+    """Лист в том виде, как его отдаёт API: без пустых ячеек в конце строк, новые объекты str."""
+    rows = []
+    for row in grid:
+        row = list(row)
+        while row and row[-1] == '':
+            row.pop()
+        rows.append(row)
+    return json.loads(json.dumps(rows, ensure_ascii=False))
+
+
+def copy_text(text):
+    return text.encode('utf-8').decode('utf-8')
+
+
+def legacy_lessons(schedule):
+    """Schedule.lessons в прежнем виде."""
+    return {
+        key: LegacyLesson(lesson.group_col, lesson.group, lesson.day, lesson.pair, lesson.time,
+                          copy_text(lesson.subject), copy_text(lesson.teacher), copy_text(lesson.cabinet))
+        for key, lesson in schedule.lessons.items()
+    }
+
+
+def measure(build):
+    """Размер живых объектов, созданных build, в байтах и сам результат."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size, result
+
+
+def read_all_rows(rows, width):
+    count = 0
+    for row in rows:
+        for col in range(width):
+            if len(row) > col and row[col].strip():
+                count += 1
+    return count
+
+
+def read_all_grid(grid, width):
+    count = 0
+    for row in range(len(grid)):
+        for col in range(width):
+            if grid.cell(row, col):
+                count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--copies', type=int, default=6, help="сколько копий листа держать в памяти")
+    parser.add_argument('--groups-per-course', type=int, default=17, help="групп на курсе (17 — около 175 колонок)")
+    args = parser.parse_args()
+
+    grid = make_grid(groups_per_course=args.groups_per_course)
+    width = max(len(row) for row in grid)
+    sources = [json.dumps(api_rows(grid), ensure_ascii=False) for _ in range(args.copies)]
+
+    rows_size, rows = measure(lambda: [json.loads(source) for source in sources])
+    grids_size, grids = measure(lambda: [SheetGrid.from_rows(json.loads(source)) for source in sources])
+    schedules = [Schedule(sheet) for sheet in grids]
+    legacy_size, _ = measure(lambda: [legacy_lessons(schedule) for schedule in schedules])
+    lessons_size, _ = measure(lambda: [Schedule(sheet).lessons for sheet in grids])
+    lessons_count = len(schedules[0].lessons)
+
+    started = time.perf_counter()
+    cells = read_all_rows(rows[0], width)
+    rows_read = time.perf_counter() - started
+    started = time.perf_counter()
+    read_all_grid(grids[0], width)
+    grid_read = time.perf_counter() - started
+    started = time.perf_counter()
+    Schedule(rows[0])
+    build_rows = time.perf_counter() - started
+    started = time.perf_counter()
+    Schedule(grids[0])
+    build_grid = time.perf_counter() - started
+
+    print(f"Лист: {len(grid)} x {width}, непустых ячеек {cells}, уникальных значений {len(grids[0].strings) - 1}, "
+          f"пар {lessons_count}; копий {args.copies}")
+    print(f"{'':34}{'было, КБ':>12}{'стало, КБ':>12}{'в раз':>8}")
+    print(f"{'Листы (список строк / SheetGrid)':34}{rows_size / 1024:12.0f}{grids_size / 1024:12.0f}"
+          f"{rows_size / max(grids_size, 1):8.1f}")
+    print(f"{'Пары (namedtuple / Lesson)':34}{legacy_size / 1024:12.0f}{lessons_size / 1024:12.0f}"
+          f"{legacy_size / max(lessons_size, 1):8.1f}")
+    print(f"Чтение всех ячеек: списки {rows_read * 1000:.1f} мс, SheetGrid {grid_read * 1000:.1f} мс")
+    print(f"Построение Schedule: из списков {build_rows * 1000:.1f} мс, из SheetGrid {build_grid * 1000:.1f} мс")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Проверка устойчивости загрузки таблицы при сбоях Google Sheets, без сети.
+
+Настоящий googleapiclient работает против локального FakeSheetsServer,
+который добавляет задержку, случайные ошибки 503 и полный отказ на время
+outage. Поверх — SheetsClient с повторами и автоматом отключения и
+SheetCache, как в bot.py. Читатели всё время запрашивают данные из кэша;
+в конце печатаются задержки чтения, доля ответов без данных, число
+запросов к API и переходы автомата.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_sheets --duration 20 --outage-at 5 --outage 8 --error-rate 0.2
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_bot import percentile  # noqa: E402
+from benchmarks.fake_sheets import FakeSheetsServer  # noqa: E402
+from benchmarks.fixtures import make_grid  # noqa: E402
+from sheets_cache import SheetCache  # noqa: E402
+from sheets_client import CircuitBreaker, SheetsClient  # noqa: E402
+
+RANGES = ("1 Семестр!A1:FS40", "2 Семестр!A1:FS40")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--duration', type=float, default=20, help="длительность, с")
+    parser.add_argument('--readers', type=int, default=8, help="потоков, читающих из кэша")
+    parser.add_argument('--latency', type=float, default=0.05, help="задержка ответа API, с")
+    parser.add_argument('--error-rate', type=float, default=0.1, help="доля ответов 503")
+    parser.add_argument('--outage-at', type=float, default=5, help="через сколько секунд API отключается")
+    parser.add_argument('--outage', type=float, default=8, help="сколько секунд API недоступно")
+    parser.add_argument('--ttl', type=float, default=2, help="срок жизни записи кэша, с")
+    parser.add_argument('--timeout', type=float, default=2, help="таймаут одной попытки, с")
+    args = parser.parse_args()
+
+    server = FakeSheetsServer(make_grid(), latency=args.latency, error_rate=args.error_rate).start()
+    sheet = server.service(timeout=args.timeout)
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=2)
+    client = SheetsClient(deadline=5, attempts=4, base_delay=0.2, max_delay=1, breaker=breaker)
+
+    def fetch(spreadsheet_id, ranges):
+        return client.execute(sheet.get(spreadsheetId=spreadsheet_id, ranges=list(ranges), includeGridData=True), 'get')
+
+    cache = SheetCache(fetch, ttl=args.ttl, check_interval=0.2)
+    cache.get("bench", RANGES)
+    cache.start()
+
+    latencies, empty, states = [], [0], []
+    lock = threading.Lock()
+    stop = time.time() + args.duration
+
+    def read():
+        while time.time() < stop:
+            started = time.perf_counter()
+            try:
+                data = cache.get("bench", RANGES)
+            except Exception:
+                data = None
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if not data:
+                    empty[0] += 1
+            time.sleep(0.01)
+
+    def watch():
+        started = time.time()
+        outage_started = False
+        while time.time() < stop:
+            if not outage_started and time.time() - started >= args.outage_at:
+                server.outage(args.outage)
+                outage_started = True
+            if not states or states[-1][1] != breaker.state:
+                states.append((time.time() - started, breaker.state))
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=read) for _ in range(args.readers)] + [threading.Thread(target=watch)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.stop()
+
+    print(f"Чтений: {len(latencies)}, без данных: {empty[0]}")
+    print(f"Задержка чтения: p50 {percentile(latencies, 0.5) * 1000:.2f} мс, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.2f} мс, максимум {max(latencies) * 1000:.1f} мс")
+    print(f"Ответы API: {dict(sorted(server.responses.items()))}")
+    print(f"Возраст данных в конце: {cache.age('bench', RANGES):.1f} с")
+    print("Автомат: " + ", ".join(f"{moment:.1f} с — {state}" for moment, state in states))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+
+class FakeSheets:
+    """Заглушка service.spreadsheets() с данными из фикстуры.
+
+    Поддерживает values().get(spreadsheetId=..., range=...).execute() и
+    get(spreadsheetId=..., ranges=[...], includeGridData=True).execute(),
+    которые использует bot.py. Каждая запрошенная вкладка отдаёт один и тот
+    же лист, объединёнными считаются заголовки курсов во второй строке.
+    latency — задержка каждого вызова в секундах, calls — число запросов.
+    """
+
+    def __init__(self, grid, latency=0.0):
+        self.grid = grid
+        self.latency = latency
+        self.calls = 0
+
+    def values(self):
+        return _Values(self)
+
+    def get(self, spreadsheetId, ranges=None, includeGridData=False, fields=None):
+        return _Request(self, lambda: self._spreadsheet(ranges or [], includeGridData))
+
+    def merges(self):
+        """Объединения ячеек заголовков курсов в формате GridRange."""
+        header, groups = self.grid[1], self.grid[2]
+        starts = [col for col, label in enumerate(header) if label]
+        ends = starts[1:] + [len(groups)]
+        return [
+            {"startRowIndex": 1, "endRowIndex": 2, "startColumnIndex": start, "endColumnIndex": end}
+            for start, end in zip(starts, ends) if end - start > 1
+        ]
+
+    def _spreadsheet(self, ranges, include_grid_data):
+        sheets = {}
+        for range_name in ranges:
+            title = range_name.rsplit('!', 1)[0].strip("'")
+            tab = sheets.setdefault(title, {"properties": {"title": title}, "merges": self.merges(), "data": []})
+            if include_grid_data:
+                tab["data"].append({"rowData": [
+                    {"values": [{"formattedValue": value} if value else {} for value in row]} for row in self.grid
+                ]})
+        return {"sheets": list(sheets.values())}
+
+
+class _Values:
+    def __init__(self, sheets):
+        self.sheets = sheets
+
+    def get(self, spreadsheetId, range):
+        return _Request(self.sheets, lambda: {"values": self.sheets.grid})
+
+
+class _Request:
+    def __init__(self, sheets, response):
+        self.sheets = sheets
+        self.response = response
+
+    def execute(self, num_retries=0):
+        self.sheets.calls += 1
+        if self.sheets.latency:
+            time.sleep(self.sheets.latency)
+        return self.response()
+
+
+class FakeSheetsServer:
+    """HTTP-сервер с REST API Google Sheets v4 поверх FakeSheets.
+
+    Отвечает на GET /v4/spreadsheets/{id}/values/{range} и
+    GET /v4/spreadsheets/{id}?ranges=...&includeGridData=true, поэтому с ним
+    работает настоящий googleapiclient (см. service). Для проверки
+    устойчивости можно задать задержку latency, долю ошибок 503 error_rate,
+    а outage(seconds) делает API недоступным на заданное время.
+    """
+
+    def __init__(self, grid, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0):
+        self.sheets = FakeSheets(grid)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.down_until = 0.0
+        self.responses = {}  # HTTP-статус -> количество
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="fake-sheets", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def outage(self, seconds):
+        self.down_until = time.time() + seconds
+
+    def service(self, timeout=10):
+        """Объект spreadsheets() настоящего клиента Google API, направленный на этот сервер."""
+        import httplib2
+        from googleapiclient.discovery import build
+        return build('sheets', 'v4', http=httplib2.Http(timeout=timeout),
+                     client_options={"api_endpoint": self.url}, static_discovery=True).spreadsheets()
+
+    def call(self, path, query):
+        """(HTTP-статус, ответ) на запрос к API."""
+        if self.latency:
+            time.sleep(self.latency)
+        if time.time() < self.down_until or random.random() < self.error_rate:
+            return 503, {"error": {"code": 503, "message": "The service is currently unavailable.", "status": "UNAVAILABLE"}}
+        parts = [unquote(part) for part in path.strip('/').split('/')]
+        if len(parts) >= 3 and parts[:2] == ["v4", "spreadsheets"]:
+            self.sheets.calls += 1
+            if len(parts) == 5 and parts[3] == "values":
+                return 200, {"range": parts[4], "majorDimension": "ROWS", "values": self.sheets.grid}
+            if len(parts) == 3:
+                include = query.get("includeGridData", ["false"])[0] == "true"
+                return 200, self.sheets._spreadsheet(query.get("ranges", []), include)
+        return 404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}}
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                status, response = server.call(url.path, parse_qs(url.query))
+                with server._lock:
+                    server.responses[status] = server.responses.get(status, 0) + 1
+                payload = json.dumps(response, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=UTF-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
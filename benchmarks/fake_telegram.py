@@ -0,0 +1,120 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+class FakeTelegram:
+    """Локальная замена Telegram Bot API для бенчмарков.
+
+    Понимает методы, которые вызывает бот: sendMessage, editMessageText,
+    sendDocument, answerCallbackQuery, answerInlineQuery, getUpdates,
+    setWebhook, deleteWebhook, getMe. Отправленные сообщения запоминаются в
+    sent. Для getUpdates обновления кладутся в очередь через push.
+    Чаты из blocked отвечают ошибкой 403, как заблокировавшие бота.
+    latency — задержка ответа на каждый запрос в секундах.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.latency = latency
+        self.blocked = set()
+        self.sent = []  # (время, метод, chat_id)
+        self.calls = {}  # метод -> число вызовов
+        self._updates = []
+        self._message_id = 0
+        self._update_id = 0
+        self._lock = threading.Lock()
+        self._has_updates = threading.Condition(self._lock)
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def api_url(self):
+        """Шаблон для telebot.apihelper.API_URL."""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/bot{{0}}/{{1}}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="fake-telegram", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def push(self, update):
+        """Добавление обновления в очередь getUpdates, update_id назначается автоматически."""
+        with self._lock:
+            self._update_id += 1
+            update["update_id"] = self._update_id
+            self._updates.append(update)
+            self._has_updates.notify_all()
+        return update
+
+    def call(self, method, params):
+        """Ответ на вызов метода API в формате Telegram."""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getUpdates":
+            return self._get_updates(params)
+        chat_id = params.get("chat_id")
+        if chat_id is not None and str(chat_id) in self.blocked:
+            return {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            with self._lock:
+                self._message_id += 1
+                message_id = self._message_id
+                self.sent.append((time.time(), method, chat_id))
+            return {"ok": True, "result": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id), "type": "private"},
+                "text": params.get("text", "")
+            }}
+        if method == "getMe":
+            return {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}}
+        return {"ok": True, "result": True}
+
+    def _get_updates(self, params):
+        offset = int(params.get("offset", 0) or 0)
+        timeout = float(params.get("timeout", 0) or 0)
+        deadline = time.time() + timeout
+        with self._lock:
+            while True:
+                self._updates = [update for update in self._updates if update["update_id"] >= offset]
+                if self._updates or time.time() >= deadline:
+                    return {"ok": True, "result": list(self._updates[:100])}
+                self._has_updates.wait(deadline - time.time())
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                method = url.path.rsplit('/', 1)[-1]
+                params = dict(parse_qsl(url.query))
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length) if length else b""
+                if body and self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+                    params.update(parse_qsl(body.decode('utf-8')))
+                response = server.call(method, params)
+                payload = json.dumps(response).encode('utf-8')
+                # Как и настоящий API, отвечаем HTTP-кодом, равным error_code
+                self.send_response(response.get("error_code", 200))
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
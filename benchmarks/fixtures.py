@@ -0,0 +1,49 @@
+import random
+
+from schedule import day_layout
+
+course_labels = ["I   к у р с", "I I  к у р с", "I I I   к у р с", "I V   к у р с", "V   курс"]
+surnames = [
+    "Иванов", "Петров", "Сидорова", "Ёлкин", "Кузнецов", "Смирнова", "Попов", "Васильева", "Соколов", "Михайлова",
+    "Новиков", "Фёдорова", "Морозов", "Волкова", "Алексеев", "Лебедева", "Семёнов", "Егорова", "Павлов", "Козлова",
+    "Степанов", "Николаева", "Орлов", "Андреева", "Макаров", "Захарова", "Зайцев", "Соловьёва", "Борисов", "Яковлева",
+    "Григорьев", "Романова", "Воробьёв", "Сергеева", "Кузьмин", "Фролова", "Александров", "Дмитриева", "Королёв", "Гусева"
+]
+subjects = [
+    "Математический анализ", "Линейная алгебра", "Физика", "Программирование", "Базы данных", "История",
+    "Философия", "Иностранный язык", "Физическая культура", "Экономика", "Сети и телекоммуникации",
+    "Операционные системы", "Дискретная математика", "Теория вероятностей", "Компьютерная графика"
+]
+
+
+def make_grid(groups_per_course=17, fill=0.65, seed=1):
+    """Синтетический лист расписания той же разметки, что и настоящий (около 175 колонок)."""
+    rnd = random.Random(seed)
+    teachers = [f"{surname} {rnd.choice('АБВГДЕИКЛМНОПС')}.{rnd.choice('АБВГДЕИКЛМНОПС')}." for surname in surnames]
+    width = 1 + len(course_labels) * (1 + groups_per_course * 2)
+    rows = max(first_row + len(times) for first_row, times in day_layout.values()) + 1
+    grid = [[""] * width for _ in range(rows)]
+    grid[0][0] = "РАСПИСАНИЕ ЗАНЯТИЙ"
+    for day, (first_row, times) in day_layout.items():
+        grid[first_row][0] = day.upper()
+    col = 1
+    for course, label in enumerate(course_labels, start=1):
+        grid[1][col] = label
+        grid[2][col] = "№ пары"
+        for first_row, times in day_layout.values():
+            for pair in range(len(times)):
+                grid[first_row + pair][col] = str(pair + 1)
+        col += 1
+        for group in range(groups_per_course):
+            grid[2][col] = f"ИВТ-{course}{group + 1:02d}"
+            for first_row, times in day_layout.values():
+                for pair in range(len(times)):
+                    if rnd.random() < fill:
+                        grid[first_row + pair][col] = f"{rnd.choice(subjects)}\n{rnd.choice(teachers)}"
+                        grid[first_row + pair][col + 1] = f"{rnd.randint(1, 5)}{rnd.randint(1, 40):02d}"
+            col += 2
+    # Как и API Sheets, не возвращаем пустые ячейки в конце строк
+    for row in grid:
+        while row and not row[-1]:
+            row.pop()
+    return grid
@@ -1,104 +1,228 @@
 import telebot
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from google.oauth2 import service_account
-from telebot import types
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
+from telebot import types, apihelper
 from api_token import BOT_TOKEN
 import time
 import configparser
-import logging
+import datetime
+import functools
 import json
+import logging
 import threading
 import os
+import re
+from schedule import Schedule, RenderCache, course_number, current_pair, day_times, days, find_day, group_key, name_tokens, normalize
+from sheets_cache import SheetCache, fingerprint, read_snapshot
+from sheet_grid import SheetGrid
+from dispatcher import UpdateDispatcher
+from webhook import WebhookServer
+from broadcast import Broadcast, RateLimiter, format_progress
+from user_store import UserStore
+from sessions import SessionStore
+from subscriptions import DailyPush, SubscriptionStore, parse_time
+from calendar_export import CalendarStore
+from sheets_client import CircuitBreaker, CircuitOpenError, SheetsClient
+from workers import WorkerPool, worker_command, worker_connection
+import metrics
 
 config = configparser.ConfigParser()
 config.read('config.ini')
 
+logging.basicConfig(
+    level=config.get('Logging', 'level', fallback='INFO'),
+    format='%(asctime)s %(levelname)s [%(threadName)s] %(message)s'
+)
+metrics.enable_tracing(config.getboolean('Metrics', 'trace', fallback=False))
+
 SPREADSHEET_ID = config['GoogleSheets']['spreadsheet_id']
+# Таблица до последней смены через /admin, к ней возвращает /rollback
+PREVIOUS_SPREADSHEET_ID = config.get('GoogleSheets', 'previous_spreadsheet_id', fallback='')
+# "main" — обычный процесс, "worker" — процесс-обработчик, запущенный WorkerPool
+PROCESS_ROLE = os.environ.get('BOT_PROCESS', 'main')
+# Лист с расписанием и все вкладки, которые загружаются вместе с ним одним запросом
+SCHEDULE_RANGE = config.get('GoogleSheets', 'schedule_range', fallback='2 Семестр!A1:FS40')
+SHEET_RANGES = tuple(
+    range_name.strip()
+    for range_name in config.get('GoogleSheets', 'ranges', fallback=SCHEDULE_RANGE).split(',')
+    if range_name.strip()
+)
+if SCHEDULE_RANGE not in SHEET_RANGES:
+    SHEET_RANGES += (SCHEDULE_RANGE,)
+SNAPSHOT_FILE = 'sheets_snapshot.json.gz'  # последние данные таблицы для быстрого старта
 
 ADMIN_ID = 653146205  # Замените на ID администратора
-USER_DATA_FILE = 'users.json'
-# Настройка бота
-bot = telebot.TeleBot(BOT_TOKEN)
-
-lock = threading.Lock()
-
-# Функция для загрузки данных пользователей
-def load_user_data():
-    try:
-        if os.path.exists(USER_DATA_FILE):
-            with open(USER_DATA_FILE, 'r') as f:
-                return json.load(f)
-        else:
-            logging.info(f"Файл {USER_DATA_FILE} не найден. Создается новый файл.")
-            return {}
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        logging.error(f"Ошибка при загрузке данных пользователей: {str(e)}")
-        return {}
-
-# Функция для сохранения данных пользователей
-def save_user_data(user_data):
-    with lock:
+USER_DATA_FILE = 'users.json'  # старый формат, переносится в базу при первом запуске
+DB_FILE = 'bot.db'
+BROADCAST_STATE_FILE = 'broadcast.json'
+
+def measured(handler):
+    """Обёртка обработчика с замером времени и подсчётом ошибок."""
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
         try:
-            with open(USER_DATA_FILE, 'w') as f:
-                json.dump(user_data, f, indent=4)
-            logging.info(f"Данные пользователей успешно сохранены в {USER_DATA_FILE}.")
-        except Exception as e:
-            logging.error(f"Ошибка при сохранении данных пользователей: {str(e)}")
-
-# Функция для добавления пользователя в JSON-файл
+            with metrics.timer('bot_handler_seconds', handler=handler.__name__):
+                return handler(*args, **kwargs)
+        except Exception:
+            metrics.inc('bot_handler_errors_total', handler=handler.__name__)
+            raise
+    return wrapper
+
+class InstrumentedTeleBot(telebot.TeleBot):
+    """TeleBot, у которого все зарегистрированные обработчики обёрнуты measured."""
+
+    def add_message_handler(self, handler_dict):
+        handler_dict['function'] = measured(handler_dict['function'])
+        super().add_message_handler(handler_dict)
+
+    def add_callback_query_handler(self, handler_dict):
+        handler_dict['function'] = measured(handler_dict['function'])
+        super().add_callback_query_handler(handler_dict)
+
+    def add_inline_handler(self, handler_dict):
+        handler_dict['function'] = measured(handler_dict['function'])
+        super().add_inline_handler(handler_dict)
+
+def send_telegram_request(method, url, **kwargs):
+    """Отправка запроса к Telegram API с учётом времени и кодов ответа по методам."""
+    api_method = url.rsplit('/', 1)[-1]
+    with metrics.timer('telegram_request_seconds', method=api_method):
+        try:
+            result = apihelper._get_req_session().request(method, url, **kwargs)
+        except Exception:
+            metrics.inc('telegram_requests_total', method=api_method, code='network_error')
+            raise
+    # Telegram отвечает HTTP-кодом, совпадающим с error_code (400, 403, 429...)
+    metrics.inc('telegram_requests_total', method=api_method, code=str(result.status_code))
+    return result
+
+apihelper.CUSTOM_REQUEST_SENDER = send_telegram_request
+# Свой сервер Bot API (например, локальный telegram-bot-api), по умолчанию api.telegram.org
+if config.get('Bot', 'api_url', fallback=''):
+    apihelper.API_URL = config.get('Bot', 'api_url')
+
+# Настройка бота: обработчики выполняются в потоках диспетчера, а не во внутреннем пуле telebot
+bot = InstrumentedTeleBot(BOT_TOKEN, threaded=False)
+dispatcher = UpdateDispatcher(
+    bot.process_new_updates,
+    workers=config.getint('Bot', 'workers', fallback=4),
+    queue_size=config.getint('Bot', 'queue_size', fallback=100),
+    overflow=config.get('Bot', 'overflow', fallback='block'),
+    # В процессе-обработчике все chat_id дают один остаток от деления на число процессов
+    stride=config.getint('Bot', 'processes', fallback=1) if PROCESS_ROLE == 'worker' else 1
+)
+
+# Пользователи бота
+user_store = UserStore(DB_FILE, legacy_json=USER_DATA_FILE)
+
+# Функция для добавления пользователя в базу
 def add_user(user):
-    user_data = load_user_data()
-    user_id = str(user.id)
-
-    if user_id not in user_data:
-        user_info = {
-            "first_seen": time.time(),
-            "username": user.username if user.username else None,
-            "first_name": user.first_name if user.first_name else None,
-            "last_name": user.last_name if user.last_name else None
-        }
-        user_data[user_id] = user_info
-        logging.info(f"Добавление нового пользователя: {user_info}")
-        save_user_data(user_data)
-    else:
-        logging.info(f"Пользователь с ID {user_id} уже существует.")
+    if user_store.add(user.id, user.username, user.first_name, user.last_name):
+        logging.info(f"Добавлен или снова активен пользователь с ID {user.id}.")
+
+def mark_users_blocked(user_ids):
+    """Пометка пользователей, заблокировавших бота, чтобы пропускать их в рассылках."""
+    user_store.set_blocked(user_ids)
+    logging.info(f"Заблокировали бота: {len(user_ids)} пользователей.")
 
 @bot.message_handler(commands=['otvet'])
 def broadcast_message(message):
     """Команда для рассылки сообщений всем пользователям (только для администратора)."""
     if message.from_user.id == ADMIN_ID:
+        if os.path.exists(BROADCAST_STATE_FILE):
+            bot.send_message(message.chat.id, "Предыдущая рассылка ещё не завершена.")
+            return
         msg = bot.send_message(message.chat.id, "Введите сообщение для рассылки:")
-        bot.register_next_step_handler(msg, send_broadcast_message)
+        next_step(msg, send_broadcast_message)
     else:
         bot.send_message(message.chat.id, "У вас нет прав для выполнения этой команды.")
 
+# Ограничение частоты отправки для рассылок
+broadcast_limiter = RateLimiter(
+    global_rate=config.getfloat('Broadcast', 'global_rate', fallback=25),
+    per_chat_rate=config.getfloat('Broadcast', 'per_chat_rate', fallback=1)
+)
+
+def new_broadcast():
+    return Broadcast(
+        bot.send_message,
+        broadcast_limiter,
+        BROADCAST_STATE_FILE,
+        workers=config.getint('Broadcast', 'workers', fallback=8),
+        on_blocked=mark_users_blocked,
+        on_progress=report_broadcast_progress
+    )
+
+def report_broadcast_progress(state):
+    """Обновление сообщения администратору с ходом рассылки."""
+    bot.edit_message_text(format_progress(state), state["admin_chat_id"], state["progress_message_id"])
+
+def run_broadcast(broadcast):
+    """Выполнение рассылки в отдельном потоке, чтобы не занимать поток обработки чата."""
+    def run():
+        state = broadcast.run()
+        bot.send_message(state["admin_chat_id"], "Рассылка завершена.\n\n" + format_progress(state))
+        logging.info("Рассылка завершена.")
+
+    threading.Thread(target=run, name="broadcast", daemon=True).start()
+
 def send_broadcast_message(message):
     """Отправка сообщения всем пользователям из списка."""
-    broadcast_text = message.text
-    user_data = load_user_data()
-
-    failed_users = []
-    for user_id in user_data:
-        try:
-            bot.send_message(user_id, broadcast_text)
-        except Exception as e:
-            logging.error(f"Не удалось отправить сообщение пользователю {user_id}: {str(e)}")
-            failed_users.append(user_id)
-
-    if failed_users:
-        bot.send_message(message.chat.id, f"Сообщение не удалось отправить следующим пользователям: {failed_users}")
-    else:
-        bot.send_message(message.chat.id, "Сообщение успешно отправлено всем пользователям.")
+    if PROCESS_ROLE == 'worker':
+        # Рассылка идёт в главном процессе: там общий с push лимит и продолжение после перезапуска
+        send_to_main(("broadcast", message.text, message.chat.id))
+        return
+    start_broadcast(message.text, message.chat.id)
 
-    logging.info("Рассылка завершена.")
+def start_broadcast(text, admin_chat_id):
+    if os.path.exists(BROADCAST_STATE_FILE):
+        bot.send_message(admin_chat_id, "Предыдущая рассылка ещё не завершена.")
+        return
+    user_ids = user_store.active_ids()
+
+    broadcast = new_broadcast()
+    state = broadcast.start(text, user_ids, admin_chat_id)
+    progress = bot.send_message(admin_chat_id, format_progress(state))
+    state["progress_message_id"] = progress.message_id
+    run_broadcast(broadcast)
+
+def resume_broadcast():
+    """Продолжение рассылки, прерванной перезапуском бота."""
+    broadcast = new_broadcast()
+    state = broadcast.resume()
+    if state is not None:
+        logging.info(f"Продолжение рассылки: осталось {len(broadcast.pending())} пользователей.")
+        run_broadcast(broadcast)
 
 @bot.message_handler(commands=['usercount'])
 def user_count(message):
     """Команда для получения количества пользователей бота (только для администратора)."""
     if message.from_user.id == ADMIN_ID:
-        user_data = load_user_data()
-        user_count = len(user_data)
-        bot.send_message(message.chat.id, f"Количество пользователей бота: {user_count}")
+        user_count = user_store.count()
+        blocked_count = user_store.count_blocked()
+        bot.send_message(message.chat.id, f"Количество пользователей бота: {user_count}\nЗаблокировали бота: {blocked_count}\n"
+                                          f"Подписаны на расписание: {subscription_store.count()}")
+    else:
+        bot.send_message(message.chat.id, "У вас нет прав для выполнения этой команды.")
+
+@bot.message_handler(commands=['stats'])
+def queue_stats(message):
+    """Команда для просмотра нагрузки на очередь обработки (только для администратора)."""
+    if message.from_user.id == ADMIN_ID:
+        stats = dispatcher.stats()
+        worker = os.environ.get('BOT_WORKER_NUMBER')
+        bot.send_message(
+            message.chat.id,
+            (f"Процесс-обработчик {worker} (остальные — на своих портах метрик)\n" if worker is not None else "") +
+            f"Обработано обновлений: {stats['processed']}\n"
+            f"С ошибкой: {stats['failed']}, отброшено: {stats['dropped']}\n"
+            f"Ожидание в очереди: среднее {stats['wait_avg'] * 1000:.0f} мс, максимум {stats['wait_max'] * 1000:.0f} мс\n"
+            f"Сейчас в очередях: {sum(stats['queued'])}\n"
+            f"Кэш ответов: попаданий {render_cache.hits}, промахов {render_cache.misses}"
+        )
     else:
         bot.send_message(message.chat.id, "У вас нет прав для выполнения этой команды.")
 
@@ -106,55 +230,431 @@ def user_count(message):
 def set_spreadsheet_id(message):
     """Команда для изменения Spreadsheet ID (только для администратора)."""
     bot.clear_step_handler_by_chat_id(message.chat.id)  # Очищаем предыдущие шаги
+    sessions.update(message.chat.id, step=None, step_args=None)
     if message.from_user.id == ADMIN_ID:
-        msg = bot.send_message(message.chat.id, "Введите новый Spreadsheet ID:")
-        bot.register_next_step_handler(msg, save_spreadsheet_id)
+        msg = bot.send_message(message.chat.id, "Введите новый Spreadsheet ID или ссылку на таблицу:")
+        next_step(msg, save_spreadsheet_id)
     else:
         bot.send_message(message.chat.id, "У вас нет прав для изменения Spreadsheet ID.")
 
 
 def save_spreadsheet_id(message):
-    global SPREADSHEET_ID
-    SPREADSHEET_ID = message.text.strip()
-
-    # Обновление в файле config.ini
-    config['GoogleSheets']['spreadsheet_id'] = SPREADSHEET_ID
-    with open('config.ini', 'w') as configfile:
-        config.write(configfile)
+    spreadsheet_id = parse_spreadsheet_id(message.text or '')
+    if spreadsheet_id is None:
+        bot.send_message(message.chat.id, "Это не похоже на Spreadsheet ID или ссылку на Google Таблицу.")
+    elif spreadsheet_id == SPREADSHEET_ID:
+        bot.send_message(message.chat.id, "Эта таблица уже используется.")
+    else:
+        start_switch(message.chat.id, spreadsheet_id)
 
-    bot.send_message(message.chat.id, f"Spreadsheet ID успешно обновлен на: {SPREADSHEET_ID}")
+@bot.message_handler(commands=['rollback'])
+def rollback_spreadsheet(message):
+    """Команда для возврата к предыдущей таблице (только для администратора)."""
+    if message.from_user.id != ADMIN_ID:
+        bot.send_message(message.chat.id, "У вас нет прав для изменения Spreadsheet ID.")
+    elif not PREVIOUS_SPREADSHEET_ID:
+        bot.send_message(message.chat.id, "Предыдущей таблицы нет, возвращаться не к чему.")
+    else:
+        start_switch(message.chat.id, PREVIOUS_SPREADSHEET_ID)
 
 # Настройка Google Sheets API
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly']
 SERVICE_ACCOUNT_FILE = 'BOT.json'
+# Проверка времени изменения файла через Drive API (нужен включённый Drive API в проекте)
+DRIVE_REVISION_CHECK = config.getboolean('GoogleSheets', 'drive_revision_check', fallback=False)
+if DRIVE_REVISION_CHECK:
+    SCOPES.append('https://www.googleapis.com/auth/drive.metadata.readonly')
 credentials = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-service = build('sheets', 'v4', credentials=credentials)
+
+def authorized_http():
+    """HTTP-клиент с таймаутом на одну попытку запроса к Google API."""
+    return AuthorizedHttp(credentials, http=httplib2.Http(timeout=config.getint('GoogleSheets', 'timeout', fallback=10)))
+
+service = build('sheets', 'v4', http=authorized_http())
 sheet = service.spreadsheets()
+drive = build('drive', 'v3', http=authorized_http()) if DRIVE_REVISION_CHECK else None
+
+# Повторы временных ошибок и отключение запросов, пока API недоступно.
+# На это время кэш продолжает отдавать последние загруженные данные (или снимок).
+sheets_client = SheetsClient(
+    deadline=config.getint('GoogleSheets', 'deadline', fallback=30),
+    attempts=config.getint('GoogleSheets', 'attempts', fallback=4),
+    attempt_timeout=config.getint('GoogleSheets', 'timeout', fallback=10),
+    breaker=CircuitBreaker(
+        failure_threshold=config.getint('GoogleSheets', 'breaker_failures', fallback=5),
+        reset_timeout=config.getint('GoogleSheets', 'breaker_reset', fallback=60)
+    )
+)
 
 # Кнопки и переменные
 role_buttons = ["Студент🧑‍🎓", "Преподаватель👨‍🏫"]
-days = ["понедельник", "вторник", "среда", "четверг", "пятница", "суббота"]
 days_for_first_course = ["понедельник", "вторник", "среда", "четверг", "пятница"]  # Суббота скрыта для первого курса
 courses = ["1 курс", "2 курс", "3 курс", "4 курс", "5 курс"]
-para_times = ['8:30-10:05', '10:15-11:50', '12:00-13:35', '14:15-15:50', '16:00-17:35', '17:45-19:20']
-saturday_para_times = ['8:30-10:05', '10:15-11:50', '12:00-13:35', '14:15-15:50']  # Время пар для субботы
-user_variables = {}
+
+# Состояние диалогов, переживает перезапуск бота
+sessions = SessionStore(
+    ttl=config.getint('Sessions', 'ttl', fallback=86400),
+    max_sessions=config.getint('Sessions', 'max_sessions', fallback=5000),
+    path=DB_FILE if config.getboolean('Sessions', 'persist', fallback=True) else None
+)
+
+def next_step(msg, handler, *args):
+    """Регистрация следующего шага диалога с сохранением его в сессии."""
+    sessions.update(msg.chat.id, step=handler.__name__, step_args=list(args))
+    bot.register_next_step_handler(msg, run_step, handler, *args)
+
+def run_step(message, handler, *args):
+    """Выполнение шага диалога, шаг снимается с сессии до вызова обработчика."""
+    sessions.update(message.chat.id, step=None, step_args=None)
+    measured(handler)(message, *args)
+
+def sheet_title(range_name):
+    """Название вкладки из диапазона вида 'Лист!A1:B2' или "'Лист'!A1:B2"."""
+    title = range_name.rsplit('!', 1)[0]
+    if len(title) > 1 and title[0] == title[-1] == "'":
+        title = title[1:-1].replace("''", "'")
+    return title
+
+def grid_values(grid_data):
+    """Значения ячеек из GridData в том же виде, что отдаёт values.get."""
+    rows = []
+    for row_data in grid_data.get('rowData', []):
+        row = [cell.get('formattedValue', '') for cell in row_data.get('values', [])]
+        while row and row[-1] == '':
+            row.pop()
+        rows.append(row)
+    while rows and not rows[-1]:
+        rows.pop()
+    return rows
+
+def fetch_workbook(spreadsheet_id, ranges):
+    """Загрузка нескольких вкладок и объединённых ячеек одним запросом.
+
+    Возвращает {"values": {диапазон: SheetGrid}, "merges": {вкладка: объединения}}.
+    Из GridData запрашиваются только отображаемые значения, без форматирования.
+    """
+    fields = 'sheets(properties/title,merges,data(startRow,startColumn,rowData/values/formattedValue))'
+    try:
+        with metrics.timer('sheets_request_seconds', method='get'):
+            result = sheets_client.execute(sheet.get(spreadsheetId=spreadsheet_id, ranges=list(ranges),
+                                                     includeGridData=True, fields=fields), 'get')
+    except CircuitOpenError:
+        raise
+    except Exception:
+        metrics.inc('sheets_requests_total', method='get', result='error')
+        raise
+    metrics.inc('sheets_requests_total', method='get', result='ok')
+
+    tabs = {item['properties']['title']: item for item in result.get('sheets', [])}
+    workbook = {"values": {}, "merges": {}}
+    taken = {}  # вкладка -> сколько её диапазонов уже разобрано
+    for range_name in ranges:
+        title = sheet_title(range_name)
+        tab = tabs.get(title, {})
+        # Для нескольких диапазонов одной вкладки data идёт в порядке запроса
+        grids = tab.get('data', [])
+        n = taken.get(title, 0)
+        taken[title] = n + 1
+        workbook["values"][range_name] = SheetGrid.from_rows(grid_values(grids[n]) if n < len(grids) else [])
+        workbook["merges"][title] = tab.get('merges', [])
+    return workbook
+
+def compact_workbook(range_name, data):
+    """Вкладки из снимка (списки строк) в виде SheetGrid, как после fetch_workbook."""
+    if isinstance(range_name, tuple):
+        data["values"] = {name: SheetGrid.from_rows(rows) for name, rows in data["values"].items()}
+    return data
+
+def fetch_sheet_version(spreadsheet_id):
+    """Время последнего изменения таблицы по данным Drive."""
+    with metrics.timer('sheets_request_seconds', method='drive.files.get'):
+        result = sheets_client.execute(drive.files().get(fileId=spreadsheet_id, fields='modifiedTime'), 'drive.files.get')
+    metrics.inc('sheets_requests_total', method='drive.files.get', result='ok')
+    return result['modifiedTime']
 
 # Кэширование данных
-cache = {
+def fetch_from_snapshot(spreadsheet_id, range_name):
+    """Данные из снимка, который пишет главный процесс. Ждёт, пока диапазон в нём появится."""
+    deadline = time.time() + 60
+    while True:
+        if os.path.exists(SNAPSHOT_FILE):
+            saved = read_snapshot(SNAPSHOT_FILE).get((spreadsheet_id, range_name))
+            if saved is not None:
+                return compact_workbook(range_name, saved["data"])
+        if time.time() > deadline:
+            raise LookupError(f"Диапазона {range_name} нет в снимке {SNAPSHOT_FILE}")
+        time.sleep(0.5)
+
+def snapshot_version(spreadsheet_id):
+    return os.path.getmtime(SNAPSHOT_FILE) if os.path.exists(SNAPSHOT_FILE) else None
+
+if PROCESS_ROLE == 'worker':
+    # Процессы-обработчики не обращаются к Google: данные берутся из снимка
+    # главного процесса, который перечитывается, только когда файл изменился
+    sheet_cache = SheetCache(
+        fetch_from_snapshot,
+        ttl=config.getint('Bot', 'snapshot_check', fallback=5),
+        max_entries=config.getint('Cache', 'max_entries', fallback=16),
+        check_interval=1,
+        probe=snapshot_version,
+        decode=compact_workbook
+    )
+else:
+    sheet_cache = SheetCache(
+        fetch_workbook,
+        ttl=config.getint('Cache', 'ttl', fallback=300),  # 5 минут
+        max_entries=config.getint('Cache', 'max_entries', fallback=16),
+        probe=fetch_sheet_version if DRIVE_REVISION_CHECK else None,
+        decode=compact_workbook
+    )
+
+# После перезапуска данные сразу берутся из снимка, а свежие загружаются в фоне
+sheet_cache.load_snapshot(SNAPSHOT_FILE)
+
+def read_workbook(spreadsheet_id):
+    """Все вкладки таблицы вместе с объединёнными ячейками."""
+    return sheet_cache.get(spreadsheet_id, SHEET_RANGES)
+
+def save_snapshot(spreadsheet_id, range_name, data, revision):
+    """Запись снимка кэша после каждого изменения данных."""
+    try:
+        sheet_cache.save_snapshot(SNAPSHOT_FILE)
+    except OSError as e:
+        logging.error(f"Не удалось сохранить снимок таблицы: {str(e)}")
+
+# Разобранное расписание, перестраивается только при смене данных в кэше
+schedule_lock = threading.Lock()
+compiled = {
     "data": None,
-    "timestamp": 0,
-    "cache_duration": 300  # 5 минут
+    "schedule": None
 }
 
-def read_google_sheet(spreadsheet_id, range_name):
-    """Чтение данных из Google Sheets с кэшированием."""
-    current_time = time.time()
-    if cache["data"] is None or (current_time - cache["timestamp"] > cache["cache_duration"]):
-        result = sheet.values().get(spreadsheetId=spreadsheet_id, range=range_name).execute()
-        cache["data"] = result.get('values', [])
-        cache["timestamp"] = current_time
-    return cache["data"]
+def rebuild_schedule(data, revision, merges=(), spreadsheet_id=None):
+    """Разбор новых данных листа и запоминание изменившихся групп и дней.
+
+    Разметка листа (курсы, группы, строки пар) определяется заново при
+    каждой новой ревизии по заголовкам и объединённым ячейкам. Данные
+    таблицы spreadsheet_id, которую уже сменили, не разбираются.
+    """
+    with schedule_lock:
+        if spreadsheet_id is not None and spreadsheet_id != SPREADSHEET_ID and compiled["schedule"] is not None:
+            # Таблицу переключили, пока загружались данные прежней
+            return compiled["schedule"]
+        if compiled["data"] is data:
+            return compiled["schedule"]
+        if compiled["schedule"] is not None and compiled["schedule"].revision == revision:
+            # Изменилась другая вкладка, лист расписания прежний
+            compiled["data"] = data
+            return compiled["schedule"]
+        with metrics.timer('schedule_build_seconds'):
+            schedule = Schedule(data, revision, merges)
+        for warning in schedule.layout.warnings:
+            logging.warning(f"Разметка листа {SCHEDULE_RANGE}: {warning}.")
+        if compiled["schedule"] is not None:
+            changes = schedule.changes_since(compiled["schedule"])
+            logging.info(f"Расписание обновлено до ревизии {revision}, изменений: {len(changes)}.")
+        compiled["schedule"] = schedule
+        compiled["data"] = data
+        if PROCESS_ROLE == 'main':
+            threading.Thread(target=update_calendars, args=(schedule,), name="calendars", daemon=True).start()
+        return schedule
+
+# Календари .ics групп и преподавателей, перегенерируются только для изменившихся
+def calendar_week_start():
+    """Понедельник недели, от которой повторяются пары в календарях.
+
+    Берётся от начала семестра ([Calendar] semester_start), без него — от
+    1 сентября или 1 февраля, чтобы не меняться при каждом перезапуске.
+    """
+    configured = config.get('Calendar', 'semester_start', fallback='').strip()
+    if configured:
+        start = datetime.date.fromisoformat(configured)
+    else:
+        today = datetime.date.today()
+        if today.month >= 9:
+            start = datetime.date(today.year, 9, 1)
+        elif today.month >= 2:
+            start = datetime.date(today.year, 2, 1)
+        else:
+            start = datetime.date(today.year - 1, 9, 1)
+    return start - datetime.timedelta(days=start.weekday())
+
+calendars = CalendarStore(config.get('Calendar', 'directory', fallback='calendars'), calendar_week_start())
+
+def update_calendars(schedule):
+    try:
+        with metrics.timer('calendar_update_seconds'):
+            calendars.update(schedule)
+    except Exception as e:
+        logging.error(f"Не удалось обновить календари: {str(e)}")
+
+def on_sheet_changed(spreadsheet_id, range_name, data, revision):
+    """Разбор расписания сразу после обновления кэша, а не в обработчике запроса."""
+    if spreadsheet_id == SPREADSHEET_ID and range_name == SHEET_RANGES:
+        rebuild_workbook_schedule(data, spreadsheet_id)
+
+sheet_cache.add_listener(on_sheet_changed)
+if PROCESS_ROLE == 'main':
+    sheet_cache.add_listener(save_snapshot)
+sheet_cache.start()
+
+def rebuild_workbook_schedule(workbook, spreadsheet_id=None):
+    """Разбор листа расписания из общей загрузки вкладок."""
+    values = workbook["values"][SCHEDULE_RANGE]
+    merges = workbook["merges"].get(sheet_title(SCHEDULE_RANGE), [])
+    return rebuild_schedule(values, fingerprint([values, merges]), merges, spreadsheet_id)
+
+def get_schedule():
+    """Получение разобранного расписания для текущих данных листа."""
+    spreadsheet_id = SPREADSHEET_ID
+    workbook = read_workbook(spreadsheet_id)
+    if compiled["data"] is not workbook["values"][SCHEDULE_RANGE]:
+        return rebuild_workbook_schedule(workbook, spreadsheet_id)
+    return compiled["schedule"]
+
+# Смена таблицы: новая загружается, разбирается и проверяется в фоне, пока бот
+# отвечает по прежней, и подставляется целиком только после успешной проверки
+switch_lock = threading.Lock()
+
+def parse_spreadsheet_id(text):
+    """Spreadsheet ID из самого ID или ссылки на таблицу, None — если не похоже ни на то, ни на другое."""
+    text = text.strip()
+    match = re.search(r'/spreadsheets/d/([A-Za-z0-9_-]+)', text)
+    if match:
+        return match.group(1)
+    return text if re.fullmatch(r'[A-Za-z0-9_-]{20,}', text) else None
+
+def load_switch_workbook(spreadsheet_id, from_google=True):
+    """Вкладки таблицы для переключения мимо кэша. Таблица, которая ещё
+    в кэше (например, предыдущая при /rollback), повторно не загружается:
+    она подставляется со своим временем загрузки и сразу обновляется в фоне."""
+    workbook = sheet_cache.peek(spreadsheet_id, SHEET_RANGES)
+    if workbook is not None:
+        return workbook
+    if from_google and PROCESS_ROLE == 'worker':
+        # Кэш процесса-обработчика читает снимок, а новой таблицы в нём ещё нет
+        return fetch_workbook(spreadsheet_id, SHEET_RANGES)
+    return sheet_cache.load(spreadsheet_id, SHEET_RANGES)
+
+def prepare_spreadsheet(spreadsheet_id, from_google=True):
+    """Загрузка, разбор и индексация таблицы без изменения текущего состояния бота.
+
+    Возвращает (вкладки, расписание). ValueError — таблица загрузилась, но
+    расписания в ней не найдено.
+    """
+    workbook = load_switch_workbook(spreadsheet_id, from_google)
+    values = workbook["values"].get(SCHEDULE_RANGE)
+    if not values:
+        raise ValueError(f"лист {SCHEDULE_RANGE} пуст")
+    merges = workbook["merges"].get(sheet_title(SCHEDULE_RANGE), [])
+    with metrics.timer('schedule_build_seconds'):
+        schedule = Schedule(values, fingerprint([values, merges]), merges)
+    if not schedule.groups:
+        raise ValueError("на листе не найдено ни одной группы")
+    if not schedule.lessons:
+        raise ValueError("в расписании не найдено ни одной пары")
+    return workbook, schedule
+
+def activate_spreadsheet(spreadsheet_id, workbook, schedule, persist=True):
+    """Подстановка подготовленной таблицы.
+
+    Данные в кэше, разобранное расписание и SPREADSHEET_ID меняются вместе
+    под schedule_lock, поэтому запрос видит либо прежнюю таблицу, либо новую
+    целиком. Прежняя остаётся в кэше и снимке для /rollback.
+    """
+    global SPREADSHEET_ID, PREVIOUS_SPREADSHEET_ID
+    with schedule_lock:
+        sheet_cache.put(spreadsheet_id, SHEET_RANGES, workbook)
+        compiled["schedule"] = schedule
+        compiled["data"] = workbook["values"][SCHEDULE_RANGE]
+        PREVIOUS_SPREADSHEET_ID, SPREADSHEET_ID = SPREADSHEET_ID, spreadsheet_id
+    for warning in schedule.layout.warnings:
+        logging.warning(f"Разметка листа {SCHEDULE_RANGE}: {warning}.")
+    logging.info(f"Таблица {PREVIOUS_SPREADSHEET_ID} заменена на {spreadsheet_id}, ревизия {schedule.revision}.")
+    if PROCESS_ROLE == 'main':
+        # Снимок пишется до config.ini: процессы-обработчики ищут новую таблицу в нём
+        save_snapshot(spreadsheet_id, SHEET_RANGES, workbook, schedule.revision)
+        threading.Thread(target=update_calendars, args=(schedule,), name="calendars", daemon=True).start()
+    if persist:
+        config['GoogleSheets']['spreadsheet_id'] = SPREADSHEET_ID
+        config['GoogleSheets']['previous_spreadsheet_id'] = PREVIOUS_SPREADSHEET_ID
+        with open('config.ini', 'w') as configfile:
+            config.write(configfile)
+
+def describe_sheet_error(error):
+    """Понятная администратору причина, по которой таблицу не удалось подключить."""
+    if isinstance(error, HttpError):
+        if error.resp.status == 404:
+            return "таблица с таким ID не найдена"
+        if error.resp.status == 403:
+            return f"нет доступа, откройте таблицу для {credentials.service_account_email}"
+        if error.resp.status == 400:
+            return f"в таблице нет нужных листов ({', '.join(SHEET_RANGES)})"
+    if isinstance(error, CircuitOpenError):
+        return "Google Sheets сейчас недоступен, попробуйте позже"
+    return str(error)
+
+def start_switch(chat_id, spreadsheet_id):
+    if not switch_lock.acquire(blocking=False):
+        bot.send_message(chat_id, "Таблица уже меняется, дождитесь окончания проверки.")
+        return
+    bot.send_message(chat_id, f"Загружаю и проверяю таблицу {spreadsheet_id}. "
+                              f"До окончания проверки бот отвечает по текущей.")
+    threading.Thread(target=switch_spreadsheet, args=(chat_id, spreadsheet_id), name="sheet-switch", daemon=True).start()
+
+def switch_spreadsheet(chat_id, spreadsheet_id):
+    """Проверка и подстановка таблицы в фоне, switch_lock уже захвачен."""
+    try:
+        try:
+            workbook, schedule = prepare_spreadsheet(spreadsheet_id)
+        except Exception as e:
+            logging.error(f"Таблица {spreadsheet_id} не подключена: {str(e)}")
+            bot.send_message(chat_id, f"Таблица не подключена: {describe_sheet_error(e)}.\n"
+                                      f"Бот продолжает работать с прежней.")
+            return
+        activate_spreadsheet(spreadsheet_id, workbook, schedule)
+        bot.send_message(chat_id, f"Spreadsheet ID успешно обновлен на: {spreadsheet_id}\n"
+                                  f"Групп: {len(schedule.groups)}, пар: {len(schedule.lessons)}.\n"
+                                  f"Вернуть прежнюю таблицу: /rollback")
+    finally:
+        switch_lock.release()
+
+def follow_spreadsheet():
+    """Переход на таблицу, которую сменил другой процесс (при [Bot] processes больше 1).
+
+    Сменивший таблицу процесс записывает её ID в config.ini. Главный процесс
+    загружает её из Google, процессы-обработчики — из снимка главного, и
+    каждый подставляет её так же, как activate_spreadsheet.
+    """
+    interval = config.getint('Bot', 'snapshot_check', fallback=5)
+    modified = os.path.getmtime('config.ini')
+    while True:
+        time.sleep(interval)
+        try:
+            current = os.path.getmtime('config.ini')
+        except OSError:
+            continue
+        if current == modified:
+            continue
+        modified = current
+        updated = configparser.ConfigParser()
+        updated.read('config.ini')
+        spreadsheet_id = updated.get('GoogleSheets', 'spreadsheet_id', fallback=SPREADSHEET_ID)
+        if spreadsheet_id == SPREADSHEET_ID:
+            continue
+        with switch_lock:
+            try:
+                workbook, schedule = prepare_spreadsheet(spreadsheet_id, from_google=False)
+            except Exception as e:
+                logging.error(f"Не удалось перейти на таблицу {spreadsheet_id}: {str(e)}")
+                continue
+            activate_spreadsheet(spreadsheet_id, workbook, schedule, persist=False)
+
+# Готовые ответы, сбрасываются при смене ревизии расписания
+render_cache = RenderCache(max_entries=config.getint('Cache', 'render_entries', fallback=2000))
+
+# Клавиатура «Прочитано» одинакова для всех ответов, поэтому сериализуется один раз
+read_markup = types.ReplyKeyboardMarkup(resize_keyboard=True).add("Прочитано").to_json()
 
 @bot.message_handler(commands=['start'])
 def start(message):
@@ -163,7 +663,7 @@ def start(message):
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
     markup.add(*role_buttons)
     msg = bot.send_message(message.chat.id, "Привет! Какое расписание тебе нужно?", reply_markup=markup)
-    bot.register_next_step_handler(msg, process_role)
+    next_step(msg, process_role)
 
 @bot.message_handler(func=lambda message: message.text == "Прочитано")
 def handle_read(message):
@@ -178,8 +678,8 @@ def process_role(message):
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
         markup.add("На один день", "На всю неделю", "Назад")
         msg = bot.send_message(message.chat.id, "🧐Вы хотите посмотреть расписание на один день или на всю неделю?", reply_markup=markup)
-        bot.register_next_step_handler(msg, handle_schedule_choice_teacher)
-    else:
+        next_step(msg, handle_schedule_choice_teacher)
+    elif not answer_group_text(message):
         start(message)
 
 def select_course(message):
@@ -188,12 +688,13 @@ def select_course(message):
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
     markup.add(*courses)
     msg = bot.send_message(chat_id, "Выберите ваш курс:", reply_markup=markup)
-    bot.register_next_step_handler(msg, handle_course_selection)
+    next_step(msg, handle_course_selection)
 
 def handle_course_selection(message):
     """Обработка выбора курса для студентов."""
     chat_id = message.chat.id
-    course = message.text.lower()
+    number = course_number(message.text or '')
+    course = f"{number} курс"
     course_mapping = {
         "1 курс": "I   к у р с",
         "2 курс": "I I  к у р с",
@@ -203,14 +704,12 @@ def handle_course_selection(message):
     }
 
     if course in course_mapping:
-        user_variables[chat_id] = {
-            "course": course_mapping[course],
-        }
+        sessions.reset(chat_id, course=course_mapping[course])
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
         markup.add("На один день", "На всю неделю", "Назад")
         msg = bot.send_message(chat_id, "Вы хотите посмотреть расписание на один день или на всю неделю?", reply_markup=markup)
-        bot.register_next_step_handler(msg, handle_schedule_choice_student)
-    else:
+        next_step(msg, handle_schedule_choice_student)
+    elif not answer_group_text(message):
         select_course(message)
 
 def handle_schedule_choice_student(message):
@@ -223,91 +722,66 @@ def handle_schedule_choice_student(message):
         select_group_weekly(message)  # Здесь нужно было исправить имя функции
     elif choice == "Назад":
         select_course(message)
-    else:
+    elif not answer_group_text(message):
         select_course(message)
 
 # Выбор дня недели для студентов
 def select_day(message):
     """Выбор дня недели для студентов."""
     chat_id = message.chat.id
-    course = user_variables[chat_id].get('course', '')
+    course = sessions.get(chat_id).get('course', '')
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
 
-    if course == "I   к у р с":
+    if course_number(course) == 1:
         markup.add(*days_for_first_course)  # Скрываем субботу для первого курса
     else:
         markup.add(*days) # Для остальных курсов отображаем субботу
 
     markup.add("Назад")
     msg = bot.send_message(chat_id, "На какой день нужно расписание?", reply_markup=markup)
-    bot.register_next_step_handler(msg, handle_day_selection)
+    next_step(msg, handle_day_selection)
 
 def handle_day_selection(message):
     """Обработка выбора дня недели и сохранение строки для этого дня."""
     chat_id = message.chat.id
     selected_day = message.text.lower()
 
-    day_row_mapping = {
-        "понедельник": 3,
-        "вторник": 9,
-        "среда": 15,
-        "четверг": 21,
-        "пятница": 27,
-        "суббота": 33
-    }
-
-    if selected_day in day_row_mapping:
-        user_variables[chat_id]['day_row'] = day_row_mapping[selected_day]
+    if selected_day in days:
+        sessions.update(chat_id, day=selected_day)
         choose_group(message)  # Переход к выбору группы после выбора дня
-    else:
+    elif not answer_group_text(message):
         bot.send_message(chat_id, "Неверный выбор дня. Пожалуйста, выберите день снова.")
         select_day(message)
 
 def find_groups_for_course(course_label):
-    """Поиск диапазона колонок для групп под объединённой ячейкой с названием курса."""
-    data = read_google_sheet(SPREADSHEET_ID, '2 Семестр!A1:FS40')
-
-    start_col = None
-    end_col = None
-    groups = []
-
-    # Поиск строки с названием курса
-    for col_num, cell in enumerate(data[1]):  # Проходим по второй строке (индекс 1)
-        if cell.strip() == course_label:
-            start_col = col_num
-            # Теперь найдём, где заканчивается объединённая ячейка
-            for next_col in range(col_num + 1, len(data[1])):
-                if data[1][next_col].strip() != "":
-                    end_col = next_col
-                    break
-            if end_col is None:  # Если не нашли ненулевую ячейку дальше, конец - последний столбец
-                end_col = len(data[1])
-            break
-
-    if start_col is not None:
-        print(f"Объединённая ячейка '{course_label}' найдена в колонке {start_col}, заканчивается в колонке {end_col - 1}")
-        print("Группы под этой ячейкой:")
-
-        for col_num in range(start_col, end_col):
-            if data[2][col_num] and data[2][col_num].strip():  # Если ячейка не пуста
-                groups.append((col_num, data[2][col_num]))
-
-        return groups
-    else:
-        print(f"Объединённая ячейка '{course_label}' не найдена.")
-        return None
+    """Поиск групп под объединённой ячейкой с названием курса."""
+    groups = get_schedule().groups_for_course(course_label)
+    if groups is None:
+        logging.info(f"Объединённая ячейка '{course_label}' не найдена.")
+    return groups
+
+def group_keyboard(course):
+    """Клавиатура с группами курса в виде JSON или None, если групп нет."""
+    schedule = get_schedule()
+
+    def render():
+        groups = find_groups_for_course(course)
+        if not groups:
+            return None
+        markup = types.InlineKeyboardMarkup(row_width=2)
+        markup.add(*[types.InlineKeyboardButton(group_name, callback_data=str(col_num)) for col_num, group_name in groups])
+        return markup.to_json()
+
+    return render_cache.get(schedule.revision, ("groups", course), render)
 
 def choose_group(message):
     """Выбор группы после выбора курса."""
     chat_id = message.chat.id
-    course = user_variables[chat_id].get('course', '')
+    course = sessions.get(chat_id).get('course', '')
 
-    groups = find_groups_for_course(course)
+    markup = group_keyboard(course)
 
-    if groups:
-        markup = types.InlineKeyboardMarkup(row_width=2)
-        buttons_group = [types.InlineKeyboardButton(group_name, callback_data=str(col_num)) for col_num, group_name in groups if group_name.strip().lower() != "№ пары"]
-        markup.add(*buttons_group)
+    if markup:
         bot.send_message(chat_id, "Выберите свою группу:", reply_markup=markup)
     else:
         bot.send_message(chat_id, "Группы для выбранного курса не найдены.")
@@ -318,64 +792,55 @@ def on_group_selected(call):
     """Обработка выбранной группы и вывод расписания на один день или на неделю."""
     chat_id = call.message.chat.id
     column_number = int(call.data)  # Получаем номер колонки
-    user_variables[chat_id]['selected_group_col'] = column_number  # Сохраняем выбранную группу
-    print(user_variables[chat_id])
+    sessions.update(chat_id, selected_group_col=column_number)  # Сохраняем выбранную группу
 
     # Проверка, что пользователь выбрал опцию на один день или на всю неделю
-    if 'day_row' in user_variables[chat_id]:
+    if 'day' in sessions.get(chat_id):
         # Если выбрана опция на один день
         send_daily_schedule_student(call.message)
     else:
         # Если выбрана опция на всю неделю
         send_weekly_schedule_student(call.message)
 
+def format_student_day(header, lessons):
+    """Текст расписания группы на один день."""
+    response = header
+    for pair, lesson in enumerate(lessons, start=1):
+        if lesson is None:
+            response += f"*{pair} пара*\n🎓 Пара: *Окно😋*\n\n"
+        else:
+            response += f"*{pair} пара*\n"
+            response += f"⏰ {lesson.time}\n"
+            response += f"🎓 Пара: *{lesson.subject}*\n"
+            response += f"👨‍🏫 Преподаватель: *{lesson.teacher}*\n"
+            response += f"🏛 Кабинет: *{lesson.cabinet}*\n\n"
+    return response
+
 def send_daily_schedule_student(message):
     """Отправка расписания на один день для студентов."""
     chat_id = message.chat.id
-    data = read_google_sheet(SPREADSHEET_ID, '2 Семестр!A1:FS40')
-    column_number = user_variables[chat_id]['selected_group_col']
-    start_row = user_variables[chat_id].get("day_row", 0)
-    group_name = data[2][column_number]
+    schedule = get_schedule()
+    session = sessions.get(chat_id)
+    column_number = session.get('selected_group_col')
+    day = session.get("day")
 
-    if column_number is None or start_row == 0:
+    if column_number not in schedule.groups or day is None:
         bot.send_message(chat_id, "Группа или день не найдены.")
         return
 
-    para_times_used = para_times if start_row != 33 else saturday_para_times  # Проверка, если суббота
-
-    response = f"Ваше расписание для группы *{group_name}*:\n\n"
-    for i in range(len(para_times_used)):  # Проверяем количество пар
-        if start_row + i < len(data):  # Проверка длины данных
-            row = data[start_row + i + 2]  # Смещение на 2 строки для корректного доступа
-            pair_info_raw = row[column_number] if len(row) > column_number else "Окно"
-            if not pair_info_raw or pair_info_raw.lower() == "окно":
-                response += f"*{i + 1} пара*\n🎓 Пара: *Окно😋*\n\n"
-            else:
-                pair_info_lines = pair_info_raw.split('\n')
-                pair_info = pair_info_lines[0].strip()
-                teacher_info = pair_info_lines[1].strip() if len(pair_info_lines) > 1 else "Преподаватель не указан"
-                cabinet_info = row[column_number + 1] if len(row) > column_number + 1 else "Кабинет не указан"
-                response += f"*{i + 1} пара*\n"
-                response += f"⏰ {para_times_used[i]}\n"
-                response += f"🎓 Пара: *{pair_info}*\n"
-                response += f"👨‍🏫 Преподаватель: *{teacher_info}*\n"
-                response += f"🏛 Кабинет: *{cabinet_info}*\n\n"
+    response = render_cache.get(schedule.revision, ("day", column_number, day), lambda: format_student_day(
+        f"Ваше расписание для группы *{schedule.groups[column_number]}*:\n\n", schedule.day_lessons(column_number, day)))
 
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    markup.add("Прочитано")
-    bot.send_message(chat_id, response, parse_mode="Markdown", reply_markup=markup)
+    bot.send_message(chat_id, response, parse_mode="Markdown", reply_markup=read_markup)
 
 def select_group_weekly(message):
     """Выбор группы для просмотра расписания на всю неделю."""
     chat_id = message.chat.id
-    course = user_variables[chat_id].get('course', '')
+    course = sessions.get(chat_id).get('course', '')
 
-    groups = find_groups_for_course(course)
+    markup = group_keyboard(course)
 
-    if groups:
-        markup = types.InlineKeyboardMarkup(row_width=2)
-        buttons_group = [types.InlineKeyboardButton(group_name, callback_data=str(col_num)) for col_num, group_name in groups if group_name.strip().lower() != "№ пары"]
-        markup.add(*buttons_group)
+    if markup:
         bot.send_message(chat_id, "Выберите свою группу:", reply_markup=markup)
     else:
         bot.send_message(chat_id, "Группы для выбранного курса не найдены.")
@@ -386,59 +851,72 @@ def on_group_selected_weekly(call):
     """Обработка выбранной группы и вывод расписания на всю неделю."""
     chat_id = call.message.chat.id
     column_number = int(call.data)  # Получаем номер колонки
-    user_variables[chat_id]['selected_group_col'] = column_number  # Сохраняем выбранную группу
+    sessions.update(chat_id, selected_group_col=column_number)  # Сохраняем выбранную группу
 
     send_weekly_schedule_student(call.message)
 
 def send_weekly_schedule_student(message):
     """Отправка расписания на всю неделю для студентов."""
     chat_id = message.chat.id
-    data = read_google_sheet(SPREADSHEET_ID, '2 Семестр!A1:FS40')
-    column_number = user_variables[chat_id]['selected_group_col']
-    group_name = data[2][column_number]
-    course = user_variables[chat_id].get('course', '')
+    schedule = get_schedule()
+    session = sessions.get(chat_id)
+    column_number = session.get('selected_group_col')
+    course = session.get('course', '')
 
-    if column_number is None:
+    if column_number not in schedule.groups:
         bot.send_message(chat_id, "Группа не найдена.")
         return
 
-    days_to_process = days_for_first_course if course == "I   к у р с" else days  # Для 1 курса скрываем субботу
-
-    day_row_mapping = {
-        "понедельник": (3, para_times),
-        "вторник": (9, para_times),
-        "среда": (15, para_times),
-        "четверг": (21, para_times),
-        "пятница": (27, para_times),
-        "суббота": (33, saturday_para_times)
-    }
+    course = schedule.group_courses.get(column_number, course)
+    days_to_process = days_for_first_course if course_number(course) == 1 else days  # Для 1 курса скрываем субботу
 
     for day in days_to_process:
-        start_row, para_times_used = day_row_mapping[day]
-        response = f"Расписание на {day} для группы *{group_name}*:\n\n"
-
-        for i in range(len(para_times_used)):  # Проверяем количество пар для каждого дня
-            if start_row + i < len(data):  # Проверка длины данных
-                row = data[start_row + i + 2]  # Смещение на 2 строки для корректного доступа
-                pair_info_raw = row[column_number] if len(row) > column_number else "Окно"
-                if not pair_info_raw or pair_info_raw.lower() == "окно":
-                    response += f"*{i + 1} пара*\n🎓 Пара: *Окно😋*\n\n"
-                else:
-                    pair_info_lines = pair_info_raw.split('\n')
-                    pair_info = pair_info_lines[0].strip()
-                    teacher_info = pair_info_lines[1].strip() if len(pair_info_lines) > 1 else "Преподаватель не указан"
-                    cabinet_info = row[column_number + 1] if len(row) > column_number + 1 else "Кабинет не указан"
-                    response += f"*{i + 1} пара*\n"
-                    response += f"⏰ {para_times_used[i]}\n"
-                    response += f"🎓 Пара: *{pair_info}*\n"
-                    response += f"👨‍🏫 Преподаватель: *{teacher_info}*\n"
-                    response += f"🏛 Кабинет: *{cabinet_info}*\n\n"
-
         # Отправляем расписание на каждый день отдельным сообщением
-        if response.strip():  # Отправляем только если есть данные для отправки
-            markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-            markup.add("Прочитано")
-            bot.send_message(chat_id, response, parse_mode="Markdown", reply_markup=markup)
+        bot.send_message(chat_id, group_day_text(schedule, column_number, day), parse_mode="Markdown", reply_markup=read_markup)
+
+def group_day_text(schedule, column_number, day):
+    """Расписание группы на день с названием дня в заголовке."""
+    return render_cache.get(schedule.revision, ("week", column_number, day), lambda: format_student_day(
+        f"Расписание на {day} для группы *{schedule.groups[column_number]}*:\n\n", schedule.day_lessons(column_number, day)))
+
+# Группу можно просто написать текстом в любой момент: «ИВТ-21», «ивт21 вторник», «ivt21 неделя»
+WEEK_WORDS = ("неделя", "неделю", "нед")
+GROUP_CHOICES_LIMIT = 10
+
+def answer_group_text(message):
+    """Расписание группы по названию из текста, без выбора курса и группы кнопками.
+
+    День берётся из текста (без него — сегодня), со словом «неделя» —
+    расписание на неделю. Если подходит несколько групп, предлагаются кнопки
+    с ними. Возвращает False, если в тексте не нашлось названия группы.
+    """
+    text = (message.text or '').strip()
+    if not text or text.startswith('/'):
+        return False
+    words = [word for word in text.split() if normalize(word) not in WEEK_WORDS]
+    week = len(words) < len(text.split())
+    day, rest = inline_day(words)
+    if not rest:
+        return False
+    chat_id = message.chat.id
+    schedule = get_schedule()
+    column_number = schedule.resolve_group(rest)
+    if column_number is None:
+        found = schedule.find_groups(rest)[:GROUP_CHOICES_LIMIT]
+        if not found:
+            return False
+        # Кнопки обрабатывает on_group_selected: с днём в сессии — на день, без него — на неделю
+        sessions.update(chat_id, day=None if week else day)
+        markup = types.InlineKeyboardMarkup(row_width=2)
+        markup.add(*[types.InlineKeyboardButton(schedule.groups[col], callback_data=str(col)) for col in found])
+        bot.send_message(chat_id, "Уточните группу:", reply_markup=markup)
+    elif week:
+        sessions.update(chat_id, selected_group_col=column_number, day=None)
+        send_weekly_schedule_student(message)
+    else:
+        sessions.update(chat_id, selected_group_col=column_number, day=day)
+        bot.send_message(chat_id, group_day_text(schedule, column_number, day), parse_mode="Markdown", reply_markup=read_markup)
+    return True
 
 
 def handle_schedule_choice_teacher(message):
@@ -456,67 +934,46 @@ def select_day_for_teacher(message):
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
     markup.add(*days)
     msg = bot.send_message(message.chat.id, 'Выберите день недели:', reply_markup=markup)
-    bot.register_next_step_handler(msg, handle_day_choice)
+    next_step(msg, handle_day_choice)
 
 def handle_day_choice(message):
     """Обработка выбора дня и запрос фамилии преподавателя."""
     day = message.text.lower()
     if day in days:
-        start_row, end_row = get_row_range(day)
         msg = bot.send_message(message.chat.id, 'Введите фамилию преподавателя👨‍🏫:')
-        bot.register_next_step_handler(msg, lambda msg: search_teacher_schedule(msg, start_row, end_row))
+        next_step(msg, search_teacher_schedule, day)
     else:
         select_day_for_teacher(message)
 
-def get_row_range(day):
-    """Получение диапазона строк для указанного дня недели."""
-    days_range = {
-        'понедельник': (6, 11),
-        'вторник': (12, 17),
-        'среда': (18, 23),
-        'четверг': (24, 29),
-        'пятница': (30, 35),
-        'суббота': (36, 40)  # Для субботы диапазон заканчивается на 40-й строке, так как максимум 4 пары
-    }
-    return days_range.get(day, (None, None))
-
-def search_teacher_schedule(message, start_row=None, end_row=None):
+def format_teacher_lessons(header, lessons):
+    """Текст расписания преподавателя."""
+    response = header
+    for lesson in lessons:
+        response += (
+            f'*❗️---{lesson.pair} пара---❗️*\n'
+            f'⏰ Время: *{lesson.time}*\n'
+            f'👥 Группа: *{lesson.group}*\n'
+            f'🎓 Название пары: *{lesson.subject}*\n'
+            f'👨‍🏫 Преподаватель: *{lesson.teacher}*\n'
+            f'🏛 Кабинет: *{lesson.cabinet}*\n\n'
+        )
+    return response
+
+def search_teacher_schedule(message, day=None):
     """Поиск расписания преподавателя."""
-    query = message.text.strip().lower()
+    query = message.text.strip()
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
     markup.add('Назад')
 
-    data = read_google_sheet(SPREADSHEET_ID, '2 Семестр!A1:FS40')
-
-    result = []
-
-    # Вычисляем соответствие времени парам
-    for i in range(start_row, end_row):
-        if i < len(data):
-            row = data[i]
-            for j, cell in enumerate(row):
-                if query in str(cell).lower():
-                    group = data[2][j]
-                    pair_info_lines = cell.split('\n')
-                    pair_info = pair_info_lines[0].strip()
-                    teacher_info = pair_info_lines[1].strip() if len(pair_info_lines) > 1 else "Преподаватель не указан"
-                    cabinet_info = row[j + 1] if len(row) > j + 1 else "Кабинет не указан"
-                    time_info = para_times[i - start_row]  # Используем индекс, чтобы подобрать время пары
-                    result.append((pair_info, group, teacher_info, cabinet_info, time_info, f'{i - start_row + 1}'))
-
-                    break
-
-    if result:
-        response = f"Расписание на выбранный день:\n\n"
-        for entry in result:
-            response += (
-                f'*❗️---{entry[5]} пара---❗️*\n'
-                f'⏰ Время: *{entry[4]}*\n'
-                f'👥 Группа: *{entry[1]}*\n'
-                f'🎓 Название пары: *{entry[0]}*\n'
-                f'👨‍🏫 Преподаватель: *{entry[2]}*\n'
-                f'🏛 Кабинет: *{entry[3]}*\n\n'
-            )
+    schedule = get_schedule()
+
+    def render():
+        result = schedule.teacher_lessons(query, day)
+        return format_teacher_lessons("Расписание на выбранный день:\n\n", result) if result else None
+
+    response = render_cache.get(schedule.revision, ("teacher", " ".join(name_tokens(query)), day), render)
+
+    if response:
         bot.send_message(message.chat.id, response, parse_mode='Markdown')
         start(message)
     else:
@@ -527,59 +984,545 @@ def search_teacher_schedule(message, start_row=None, end_row=None):
 def select_teacher_weekly(message):
     """Запрос фамилии преподавателя для просмотра расписания на всю неделю."""
     msg = bot.send_message(message.chat.id, 'Введите фамилию преподавателя👨‍🏫:')
-    bot.register_next_step_handler(msg, send_weekly_schedule_teacher)
+    next_step(msg, send_weekly_schedule_teacher)
 
 def send_weekly_schedule_teacher(message):
     """Отправка расписания на всю неделю для преподавателей."""
     chat_id = message.chat.id
-    query = message.text.strip().lower()
-    data = read_google_sheet(SPREADSHEET_ID, '2 Семестр!A1:FS40')
-
-    day_row_mapping = {
-        "понедельник": (6, 11, para_times),
-        "вторник": (12, 17, para_times),
-        "среда": (18, 23, para_times),
-        "четверг": (24, 29, para_times),
-        "пятница": (30, 35, para_times),
-        "суббота": (36, 40, saturday_para_times)
-    }
+    query = message.text.strip()
+    schedule = get_schedule()
+
+    def render():
+        lessons = schedule.teacher_lessons(query)
+        responses = []
+        for day in days:
+            result = [lesson for lesson in lessons if lesson.day == day]
+            if result:
+                responses.append(format_teacher_lessons(f"Расписание на {day}:\n\n", result))
+        return responses
 
-    for day, (start_row, end_row, para_times_used) in day_row_mapping.items():
-        result = []
-        for i in range(start_row, end_row):
-            if i < len(data):  # Проверка длины данных
-                row = data[i]
-                for j, cell in enumerate(row):
-                    if query in str(cell).lower():
-                        group = data[2][j]
-                        pair_info_lines = cell.split('\n')
-                        pair_info = pair_info_lines[0].strip()
-                        teacher_info = pair_info_lines[1].strip() if len(pair_info_lines) > 1 else "Преподаватель не указан"
-                        cabinet_info = row[j + 1] if len(row) > j + 1 else "Кабинет не указан"
-                        time_info = para_times_used[i - start_row]  # Используем индекс для подбора времени пары
-                        result.append((pair_info, group, teacher_info, cabinet_info, time_info, f'{i - start_row + 1}'))
-
-                        break
-
-        if result:
-            response = f"Расписание на {day}:\n\n"
-            for entry in result:
-                response += (
-                    f'*❗️---{entry[5]} пара---❗️*\n'
-                    f'⏰ Время: *{entry[4]}*\n'
-                    f'👥Группа: *{entry[1]}*\n'
-                    f'🎓 Название пары: *{entry[0]}*\n'
-                    f'👨‍🏫 Преподаватель: *{entry[2]}*\n'
-                    f'🏛 Кабинет: *{entry[3]}*\n\n'
-                )
-            bot.send_message(chat_id, response, parse_mode='Markdown')
+    for response in render_cache.get(schedule.revision, ("teacher_week", " ".join(name_tokens(query))), render):
+        bot.send_message(chat_id, response, parse_mode='Markdown')
 
     start(message)
 
-while True:
-    try:
-        logging.info("Запуск бота...")
-        bot.polling(none_stop=True, interval=0, timeout=20)
-    except Exception as e:
-        logging.error(f"Произошла ошибка: {str(e)}")
-        time.sleep(5)  # Задержка перед перезапуском
\ No newline at end of file
+# Поиск через inline-режим (@bot группа день или @bot фамилия день), включается в BotFather командой /setinline
+INLINE_RESULTS_LIMIT = 20
+MESSAGE_LIMIT = 4096
+
+def inline_day(words):
+    """День из слов запроса и оставшиеся слова. Без дня — сегодня (в воскресенье — понедельник)."""
+    weekday = time.localtime().tm_wday
+    day = None
+    rest = []
+    for word in words:
+        if word.lower() == "сегодня":
+            found = days[weekday] if weekday < len(days) else days[0]
+        elif word.lower() == "завтра":
+            found = days[weekday + 1] if weekday + 1 < len(days) else days[0]
+        else:
+            found = find_day(word)
+        if found is not None and day is None:
+            day = found
+        else:
+            rest.append(word)
+    if day is None:
+        day = days[weekday] if weekday < len(days) else days[0]
+    return day, " ".join(rest)
+
+def inline_article(result_id, title, description, text):
+    return types.InlineQueryResultArticle(
+        id=result_id,
+        title=title,
+        description=description,
+        input_message_content=types.InputTextMessageContent(text[:MESSAGE_LIMIT], parse_mode='Markdown')
+    )
+
+def build_inline_results(schedule, day, rest):
+    """Результаты inline-запроса на день: сначала подходящие группы, затем преподаватели."""
+    if not rest:
+        return []
+    results = []
+    for col in schedule.find_groups(rest)[:INLINE_RESULTS_LIMIT]:
+        group = schedule.groups[col]
+        lessons = schedule.day_lessons(col, day)
+        count = sum(lesson is not None for lesson in lessons)
+        text = format_student_day(f"Расписание на {day} для группы *{group}*:\n\n", lessons)
+        results.append(inline_article(f"g:{col}:{days.index(day)}", f"{group} — {day}", f"Пар: {count}", text))
+
+    if not results:
+        # Пары одного преподавателя собираются в одну статью, точное совпадение фамилии выше
+        by_teacher = {}
+        for lesson in schedule.teacher_lessons(rest, day):
+            by_teacher.setdefault(lesson.teacher, []).append(lesson)
+        words = set(name_tokens(rest))
+        ranked = sorted(by_teacher.items(), key=lambda item: (not words & set(name_tokens(item[0])), item[0]))
+        for n, (teacher, lessons) in enumerate(ranked[:INLINE_RESULTS_LIMIT]):
+            text = format_teacher_lessons(f"Расписание преподавателя *{teacher}* на {day}:\n\n", lessons)
+            results.append(inline_article(f"t:{n}:{days.index(day)}", f"{teacher} — {day}", f"Пар: {len(lessons)}", text))
+    return results
+
+@bot.inline_handler(func=lambda query: True)
+def answer_inline_query(inline_query):
+    """Ответ на inline-запрос одним вызовом API из готового индекса расписания."""
+    schedule = get_schedule()
+    # День определяется до кэша: «сегодня», «завтра» и запрос без дня зависят от даты
+    day, rest = inline_day(inline_query.query.split())
+    # Поиск группы нечувствителен к дефису, поэтому в ключе исходный запрос без регистра
+    key = ("inline", day, rest.lower())
+    results = render_cache.get(schedule.revision, key, lambda: build_inline_results(schedule, day, rest))
+    # Telegram может кэшировать ответ, пока данные листа гарантированно не обновятся, но не дольше полуночи
+    now = datetime.datetime.now()
+    midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+    cache_time = int(min(sheet_cache.expires_in(SPREADSHEET_ID, SHEET_RANGES), (midnight - now).total_seconds()))
+    if inline_query.query.strip() and not results:
+        bot.answer_inline_query(inline_query.id, [], cache_time=cache_time,
+                                switch_pm_text="Ничего не найдено, открыть бота", switch_pm_parameter="start")
+    else:
+        bot.answer_inline_query(inline_query.id, results, cache_time=cache_time)
+
+# Подписка на расписание на завтра, которое приходит само в выбранное время
+PUSH_TIMES = [t.strip() for t in config.get('Push', 'times', fallback='19:00, 20:00, 21:00').split(',') if t.strip()]
+subscription_store = SubscriptionStore(DB_FILE)
+
+def render_push(group, date):
+    """Текст расписания группы на дату, один на всех подписчиков группы. None — пар нет."""
+    if date.weekday() >= len(days):
+        return None
+    day = days[date.weekday()]
+    schedule = get_schedule()
+    column_number = schedule.group_cols.get(group)
+    if column_number is None:
+        logging.warning(f"Группа {group} из подписки не найдена в таблице.")
+        return None
+
+    def render():
+        lessons = schedule.day_lessons(column_number, day)
+        if not any(lessons):
+            return None
+        return format_student_day(f"Расписание на завтра ({day}) для группы *{group}*:\n\n", lessons)
+
+    return render_cache.get(schedule.revision, ("push", column_number, day), render)
+
+daily_push = DailyPush(
+    subscription_store,
+    render_push,
+    lambda chat_id, text: bot.send_message(chat_id, text, parse_mode='Markdown'),
+    broadcast_limiter,
+    workers=config.getint('Push', 'workers', fallback=8),
+    on_blocked=mark_users_blocked
+)
+
+@bot.message_handler(commands=['subscribe'])
+def subscribe(message):
+    """Подписка на ежедневное расписание группы."""
+    add_user(message.from_user)
+    msg = bot.send_message(message.chat.id, "Введите название группы (например, ИВТ-101):",
+                           reply_markup=types.ReplyKeyboardRemove())
+    next_step(msg, save_subscription_group)
+
+def save_subscription_group(message):
+    """Поиск группы для подписки и выбор времени отправки."""
+    schedule = get_schedule()
+    text = message.text or ""
+    found = schedule.find_groups(text)
+    if not found or (len(found) > 1 and group_key(schedule.groups[found[0]]) != group_key(text)):
+        markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=3)
+        markup.add(*[schedule.groups[col] for col in found[:12]])
+        reply = "Уточните группу:" if found else "Группа не найдена, попробуйте ещё раз:"
+        msg = bot.send_message(message.chat.id, reply, reply_markup=markup if found else None)
+        next_step(msg, save_subscription_group)
+        return
+    group = schedule.groups[found[0]]
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=3)
+    markup.add(*PUSH_TIMES)
+    msg = bot.send_message(message.chat.id, f"Группа *{group}*. Во сколько присылать расписание на завтра?",
+                           parse_mode='Markdown', reply_markup=markup)
+    next_step(msg, save_subscription_time, group)
+
+def save_subscription_time(message, group):
+    """Сохранение подписки."""
+    send_time = parse_time(message.text or "")
+    if send_time is None:
+        msg = bot.send_message(message.chat.id, "Введите время в формате ЧЧ:ММ, например 20:00:")
+        next_step(msg, save_subscription_time, group)
+        return
+    subscription_store.subscribe(message.chat.id, group, send_time)
+    bot.send_message(message.chat.id, f"Готово! Расписание группы *{group}* на завтра будет приходить в {send_time}.\n"
+                                      f"Отписаться: /unsubscribe", parse_mode='Markdown')
+    start(message)
+
+@bot.message_handler(commands=['unsubscribe'])
+def unsubscribe(message):
+    """Отмена подписки на ежедневное расписание."""
+    if subscription_store.unsubscribe([message.chat.id]):
+        bot.send_message(message.chat.id, "Подписка отменена.")
+    else:
+        bot.send_message(message.chat.id, "У вас нет подписки. Оформить: /subscribe")
+
+# Занятость кабинетов: свободные кабинеты на пару, неделя кабинета и накладки
+def parse_slot(schedule, words):
+    """День и номер пары из аргументов команды. Без них — сегодня и идущая или следующая пара.
+
+    Возвращает (день, пара, ошибка): при ошибке день и пара — None, а ошибка —
+    текст для пользователя. Номер пары проверяется по парам дня в расписании.
+    """
+    day, pair = None, None
+    for word in words:
+        if word.isdecimal():
+            pair = int(word)
+        elif find_day(word) is not None:
+            day = find_day(word)
+    now = time.localtime()
+    if day is None:
+        if now.tm_wday >= len(days):
+            return None, None, "Сегодня занятий нет."
+        day = days[now.tm_wday]
+        if pair is None and not any(words):
+            pair = current_pair(day, now.tm_hour * 60 + now.tm_min)
+            if pair is None:
+                return None, None, "На сегодня пары закончились."
+    if pair is None:
+        return None, None, "Не указан номер пары."
+    pairs = [number for _, number, _ in schedule.layout.days.get(day, [])]
+    if pair not in pairs:
+        if not pairs:
+            return None, None, f"В день «{day}» пар нет."
+        return None, None, f"Пары {pair} в день «{day}» нет, есть пары с {min(pairs)} по {max(pairs)}."
+    return day, pair, None
+
+def format_free_rooms(schedule, day, pair):
+    rooms = schedule.free_rooms(day, pair)
+    times = day_times(day)
+    time_range = times[pair - 1] if pair <= len(times) else ""
+    header = f"Свободные кабинеты: {day}, *{pair} пара* ({time_range})\n\n"
+    return header + (", ".join(rooms) if rooms else "Свободных кабинетов нет.")
+
+def format_room_week(cabinet, lessons):
+    """Занятость кабинета по дням. Общая пара нескольких групп выводится одной строкой."""
+    slots = {}
+    for lesson in lessons:
+        slots.setdefault((lesson.day, lesson.pair, lesson.subject, lesson.teacher), []).append(lesson)
+    response = f"Кабинет *{cabinet}*:\n"
+    current_day = None
+    for (day, pair, _, _), slot in slots.items():
+        if day != current_day:
+            response += f"\n*{day.capitalize()}*\n"
+            current_day = day
+        groups = ", ".join(lesson.group for lesson in slot)
+        response += f"{pair} пара ({slot[0].time}): {slot[0].subject} — {groups}, {slot[0].teacher}\n"
+    return response
+
+@bot.message_handler(commands=['free'])
+def free_rooms(message):
+    """Свободные кабинеты: /free, /free среда 3."""
+    schedule = get_schedule()
+    day, pair, error = parse_slot(schedule, message.text.split()[1:])
+    if error is not None:
+        bot.send_message(message.chat.id, f"{error} Укажите день и пару, например: /free пн 2")
+        return
+    response = render_cache.get(schedule.revision, ("free", day, pair), lambda: format_free_rooms(schedule, day, pair))
+    bot.send_message(message.chat.id, response, parse_mode='Markdown')
+
+@bot.message_handler(commands=['room'])
+def room_occupancy(message):
+    """Занятость кабинета на неделю: /room 301."""
+    cabinet = message.text.partition(' ')[2].strip()
+    if not cabinet:
+        bot.send_message(message.chat.id, "Укажите кабинет, например: /room 301")
+        return
+    schedule = get_schedule()
+    lessons = schedule.cabinet_lessons(cabinet)
+    if not lessons:
+        bot.send_message(message.chat.id, f"В кабинете {cabinet} занятий нет или такого кабинета нет в расписании.")
+        return
+    response = render_cache.get(schedule.revision, ("room", cabinet), lambda: format_room_week(cabinet, lessons))
+    bot.send_message(message.chat.id, response[:MESSAGE_LIMIT], parse_mode='Markdown')
+
+@bot.message_handler(commands=['conflicts'])
+def room_conflicts(message):
+    """Кабинеты, занятые разными парами одновременно (только для администратора)."""
+    if message.from_user.id != ADMIN_ID:
+        bot.send_message(message.chat.id, "У вас нет прав для выполнения этой команды.")
+        return
+    conflicts = get_schedule().conflicts
+    if not conflicts:
+        bot.send_message(message.chat.id, "Накладок по кабинетам нет.")
+        return
+    lines = [
+        f"{cabinet}, {day}, {pair} пара: " + "; ".join(f"{lesson.group} — {lesson.subject}" for lesson in lessons)
+        for cabinet, day, pair, lessons in conflicts
+    ]
+    bot.send_message(message.chat.id, f"Накладок: {len(conflicts)}\n\n" + "\n".join(lines)[:MESSAGE_LIMIT - 20])
+
+def json_response(payload, status=200):
+    return status, 'application/json; charset=utf-8', json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+def lesson_json(lesson):
+    return {"day": lesson.day, "pair": lesson.pair, "time": lesson.time, "group": lesson.group,
+            "subject": lesson.subject, "teacher": lesson.teacher, "cabinet": lesson.cabinet}
+
+def api_free_rooms(params):
+    """GET /api/free?day=среда&pair=3 — свободные кабинеты."""
+    schedule = get_schedule()
+    day, pair, error = parse_slot(schedule, [params.get('day', ''), params.get('pair', '')])
+    if error is not None:
+        return json_response({"error": error}, 400)
+    return json_response({"revision": schedule.revision, "day": day, "pair": pair, "rooms": schedule.free_rooms(day, pair)})
+
+def api_room(params):
+    """GET /api/room?cabinet=301 — занятия в кабинете за неделю."""
+    schedule = get_schedule()
+    cabinet = params.get('cabinet', '').strip()
+    return json_response({"revision": schedule.revision, "cabinet": cabinet,
+                          "lessons": [lesson_json(lesson) for lesson in schedule.cabinet_lessons(cabinet)]})
+
+def api_conflicts(params):
+    """GET /api/conflicts — накладки по кабинетам."""
+    schedule = get_schedule()
+    return json_response({"revision": schedule.revision, "conflicts": [
+        {"cabinet": cabinet, "day": day, "pair": pair, "lessons": [lesson_json(lesson) for lesson in lessons]}
+        for cabinet, day, pair, lessons in schedule.conflicts
+    ]})
+
+def find_calendar(schedule, query):
+    """Календарь по названию группы или фамилии преподавателя: (вид, название) или None."""
+    found = schedule.find_groups(query)
+    if found and (len(found) == 1 or group_key(schedule.groups[found[0]]) == group_key(query)):
+        return "group", schedule.groups[found[0]]
+    if found:
+        return None  # несколько подходящих групп, нужно уточнить
+    teachers = {lesson.teacher for lesson in schedule.teacher_lessons(query)}
+    if len(teachers) == 1:
+        return "teacher", teachers.pop()
+    return None
+
+@bot.message_handler(commands=['ics'])
+def send_calendar(message):
+    """Календарь группы или преподавателя файлом .ics: /ics ИВТ-101, /ics Иванов."""
+    query = message.text.partition(' ')[2].strip()
+    if not query:
+        bot.send_message(message.chat.id, "Укажите группу или фамилию преподавателя, например: /ics ИВТ-101")
+        return
+    found = find_calendar(get_schedule(), query)
+    path = calendars.path(*found) if found else None
+    if path is None or not os.path.exists(path):
+        bot.send_message(message.chat.id, "Не нашёл такую группу или преподавателя, уточните запрос.")
+        return
+    kind, name = found
+    caption = f"Расписание {name}. Откройте файл в приложении календаря."
+    file_id = calendars.file_id(kind, name)
+    if file_id:
+        # Файл не менялся с прошлой отправки — Telegram возьмёт его у себя
+        bot.send_document(message.chat.id, file_id, caption=caption)
+        return
+    # Отпечаток берётся до чтения файла: если файл перепишут во время отправки, file_id не запомнится
+    digest = calendars.digest(kind, name)
+    with open(path, 'rb') as f:
+        sent = bot.send_document(message.chat.id, f, caption=caption, visible_file_name=f"{name}.ics")
+    if getattr(sent, 'document', None) is not None:
+        calendars.set_file_id(kind, name, sent.document.file_id, digest)
+
+def api_calendar(params):
+    """GET /calendar?group=ИВТ-101 или ?teacher=Иванов И.И. — файл .ics для подписки в календаре."""
+    kind = 'group' if 'group' in params else 'teacher'
+    path = calendars.path(kind, params.get(kind, ''))
+    if path is None or not os.path.exists(path):
+        return 404, 'text/plain; charset=utf-8', "Календарь не найден".encode('utf-8')
+    with open(path, 'rb') as f:
+        return 200, 'text/calendar; charset=utf-8', f.read()
+
+# Доступны только на сервере метрик ([Metrics] listen), webhook-сервер открыт наружу
+api_routes = {
+    '/api/free': api_free_rooms,
+    '/api/room': api_room,
+    '/api/conflicts': api_conflicts,
+    '/calendar': api_calendar
+}
+
+# Шаги диалога, которые можно продолжить после перезапуска по имени из сессии
+step_handlers = {handler.__name__: handler for handler in [
+    send_broadcast_message, save_spreadsheet_id, process_role, handle_schedule_choice_teacher,
+    handle_course_selection, handle_schedule_choice_student, handle_day_selection,
+    handle_day_choice, search_teacher_schedule, send_weekly_schedule_teacher,
+    save_subscription_group, save_subscription_time
+]}
+
+# Регистрируется последним: получает только сообщения, для которых у telebot нет следующего шага
+@bot.message_handler(func=lambda message: True)
+def resume_step(message):
+    """Продолжение диалога, шаг которого был потерян при перезапуске бота."""
+    session = sessions.get(message.chat.id)
+    handler = step_handlers.get(session.get('step'))
+    if handler is not None:
+        run_step(message, handler, *session.get('step_args', []))
+    elif "курс" in (message.text or '').lower() and course_number(message.text) is not None:
+        # «3 курс» без начатого диалога — сразу к выбору дня или недели
+        handle_course_selection(message)
+    else:
+        answer_group_text(message)
+
+# Значения, которые читаются при каждом запросе /metrics
+metrics.gauge('bot_active_sessions', lambda: len(sessions))
+metrics.gauge('bot_queue_depth', lambda: {(('worker', n),): size for n, size in enumerate(dispatcher.stats()['queued'])})
+metrics.gauge('render_cache_requests_total', lambda: {
+    (('result', 'hit'),): render_cache.hits,
+    (('result', 'miss'),): render_cache.misses
+}, kind='counter')
+metrics.gauge('bot_users', lambda: user_store.count())
+metrics.gauge('bot_subscriptions', lambda: subscription_store.count())
+# 0 — Google Sheets доступен, 1 — пробный запрос, 2 — запросы приостановлены
+metrics.gauge('sheets_circuit_state', lambda: {
+    CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2
+}[sheets_client.breaker.state])
+# Возраст отдаваемых данных: растёт, пока таблицу не удаётся обновить
+metrics.gauge('sheet_data_age_seconds', lambda: sheet_cache.age(SPREADSHEET_ID, SHEET_RANGES))
+
+def start_metrics(worker_number=None):
+    """Сервер метрик. Процесс-обработчик номер N слушает [Metrics] port + 1 + N:
+    у каждого процесса свой реестр метрик, и собирать их нужно со всех портов."""
+    if config.getboolean('Metrics', 'enabled', fallback=True):
+        port = config.getint('Metrics', 'port', fallback=9100)
+        if worker_number is not None:
+            port += 1 + worker_number
+        metrics.serve(config.get('Metrics', 'listen', fallback='127.0.0.1'), port, routes=api_routes)
+
+def warm_up():
+    """Загрузка и разбор расписания до первого пользователя, в фоновом потоке."""
+    def load():
+        try:
+            get_schedule()
+        except Exception as e:
+            logging.error(f"Не удалось заранее загрузить расписание: {str(e)}")
+    threading.Thread(target=load, name="warm-up", daemon=True).start()
+
+def start_push():
+    if config.getboolean('Push', 'enabled', fallback=True):
+        daily_push.start()
+
+worker_pools = []  # запущенный WorkerPool, если обработка идёт в нескольких процессах
+send_to_main = None  # в процессе-обработчике: передача поручения главному процессу
+
+def handle_worker_message(message):
+    """Поручение от процесса-обработчика главному процессу."""
+    if message[0] == "broadcast":
+        start_broadcast(*message[1:])
+    else:
+        logging.warning(f"Неизвестное сообщение процесса-обработчика: {message[0]}")
+
+def start_processing(on_done=None):
+    """Запуск обработки обновлений. Возвращает функцию, принимающую обновление.
+
+    При [Bot] processes больше 1 обновления делятся между процессами-обработчиками,
+    иначе обрабатываются диспетчером в этом процессе. on_done(update_id)
+    вызывается после обработки каждого обновления в процессах-обработчиках.
+
+    Метрики обработчиков (время ответа, очередь, кэш ответов, сессии) при
+    этом есть только у процессов-обработчиков, на портах [Metrics] port + 1 + N,
+    а /stats показывает процесс, которому достался чат администратора.
+    """
+    processes = config.getint('Bot', 'processes', fallback=1)
+    if processes > 1:
+        if not config.getboolean('Sessions', 'persist', fallback=True):
+            logging.warning("С несколькими процессами сессии нужно хранить в базе: [Sessions] persist = yes.")
+        pool = WorkerPool(worker_command(__file__), processes=processes,
+                          queue_size=config.getint('Bot', 'queue_size', fallback=100) * 10, on_done=on_done,
+                          on_message=handle_worker_message)
+        pool.start()
+        worker_pools.append(pool)
+        metrics.gauge('bot_worker_processes', lambda: pool.stats()['alive'])
+        threading.Thread(target=follow_spreadsheet, name="sheet-follow", daemon=True).start()
+        return pool.submit
+    dispatcher.start()
+    return dispatcher.submit
+
+def run_worker():
+    """Процесс-обработчик: получает обновления своих чатов от главного процесса."""
+    global send_to_main
+    number, connection = worker_connection()
+    logging.info(f"Процесс-обработчик {number} подключён.")
+    process = dispatcher.process
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            connection.send(message)
+
+    send_to_main = send
+
+    def process_and_report(updates):
+        """Обработка с уведомлением главного процесса о завершении."""
+        try:
+            process(updates)
+        finally:
+            with send_lock:
+                for update in updates:
+                    connection.send(update.update_id)
+
+    dispatcher.process = process_and_report
+    dispatcher.start()
+    start_metrics(number)
+    threading.Thread(target=follow_spreadsheet, name="sheet-follow", daemon=True).start()
+    warm_up()
+    while True:
+        try:
+            update = connection.recv()
+        except EOFError:
+            logging.info("Главный процесс завершился, процесс-обработчик останавливается.")
+            return
+        dispatcher.submit(update)
+
+def run_polling():
+    """Получение обновлений long polling и передача их диспетчеру."""
+    start_metrics()
+    warm_up()
+    bot.remove_webhook()
+    submit = start_processing()
+    resume_broadcast()
+    start_push()
+    offset = None
+    delay = 5
+    while True:
+        try:
+            logging.info("Запуск бота...")
+            while True:
+                for update in bot.get_updates(offset=offset, timeout=30, long_polling_timeout=20):
+                    offset = update.update_id + 1
+                    submit(update)
+                delay = 5
+        except Exception as e:
+            logging.error(f"Произошла ошибка: {str(e)}")
+            time.sleep(delay)  # Задержка перед перезапуском, растёт при повторных ошибках
+            delay = min(delay * 2, 300)
+
+def run_webhook():
+    """Приём обновлений через встроенный webhook-сервер."""
+    url = config.get('Webhook', 'url', fallback='')
+    if not url and not config.get('Webhook', 'secret_token', fallback=''):
+        # Секрет генерируется только вместе с setWebhook, иначе Telegram его не узнает
+        logging.error("Webhook настроен снаружи ([Webhook] url пуст), поэтому нужен [Webhook] secret_token.")
+        return
+    server = WebhookServer(
+        None,
+        host=config.get('Webhook', 'listen', fallback='0.0.0.0'),
+        port=config.getint('Webhook', 'port', fallback=8443),
+        path=config.get('Webhook', 'path', fallback='/webhook'),
+        secret_token=config.get('Webhook', 'secret_token', fallback='')
+    )
+    start_metrics()
+    warm_up()
+    if url:
+        # Без url считаем, что webhook уже настроен снаружи (например, за балансировщиком)
+        bot.set_webhook(url=url, secret_token=server.secret_token)
+    server.submit = start_processing()
+    resume_broadcast()
+    start_push()
+    server.serve_forever()
+
+if __name__ == '__main__':
+    if PROCESS_ROLE == 'worker':
+        run_worker()
+    elif config.get('Bot', 'mode', fallback='polling') == 'webhook':
+        run_webhook()
+    else:
+        run_polling()
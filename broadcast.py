@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot.apihelper import ApiTelegramException
+
+
+class TokenBucket:
+    """Ограничитель частоты: не более rate событий в секунду с запасом capacity."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        """Остановка выдачи на время, указанное Telegram в retry_after."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    self.updated = now
+                    wait = self.paused_until - now
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """Общий лимит отправки бота и отдельный лимит на каждый чат."""
+
+    def __init__(self, global_rate=25, per_chat_rate=1):
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self._chats = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, chat_id):
+        with self._lock:
+            bucket = self._chats.get(chat_id)
+            if bucket is None:
+                if len(self._chats) > 10000:
+                    self._chats.clear()
+                bucket = self._chats[chat_id] = TokenBucket(self.per_chat_rate, 1)
+        bucket.acquire()
+        self.global_bucket.acquire()
+
+
+def deliver(send, limiter, chat_id, text, max_retries=3):
+    """Отправка одного сообщения с соблюдением лимитов. Возвращает (результат, ошибка).
+
+    Результат — "sent", "blocked" (ответ 403) или "failed". На ответ 429
+    общий лимит приостанавливается на retry_after и отправка повторяется.
+    """
+    error = None
+    for _ in range(max_retries + 1):
+        limiter.acquire(chat_id)
+        try:
+            send(chat_id, text)
+            return "sent", None
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                retry_after = e.result_json.get('parameters', {}).get('retry_after', 5)
+                logging.warning(f"Превышен лимит Telegram, пауза {retry_after} с.")
+                limiter.global_bucket.pause(retry_after)
+                error = e.description
+                continue
+            if e.error_code == 403:
+                return "blocked", None
+            error = e.description
+            break
+        except Exception as e:
+            error = str(e)
+            break
+    logging.error(f"Не удалось отправить сообщение пользователю {chat_id}: {error}")
+    return "failed", error
+
+
+class Broadcast:
+    """Рассылка одного текста списку пользователей с сохранением прогресса.
+
+    Сообщения отправляются несколькими потоками через RateLimiter. На ответ
+    429 отправка приостанавливается на retry_after и повторяется, на 403
+    (бот заблокирован) пользователь запоминается и в конце рассылки весь
+    список передаётся в on_blocked. Прогресс периодически записывается в state_file,
+    поэтому прерванная рассылка продолжается с места остановки через resume.
+    """
+
+    def __init__(self, send, limiter, state_file, workers=8, on_blocked=None, on_progress=None, max_retries=3):
+        self.send = send  # функция (chat_id, text)
+        self.limiter = limiter
+        self.state_file = state_file
+        self.workers = workers
+        self.on_blocked = on_blocked  # функция (список user_id, заблокировавших бота)
+        self.on_progress = on_progress  # функция (state), вызывается не чаще раза в несколько секунд
+        self.max_retries = max_retries
+        self.state = None
+        self._lock = threading.Lock()
+        self._last_saved = 0.0
+
+    def start(self, text, user_ids, admin_chat_id):
+        self.state = {
+            "text": text,
+            "admin_chat_id": admin_chat_id,
+            "progress_message_id": None,
+            "users": [str(user_id) for user_id in user_ids],
+            "done": [],
+            "sent": 0,
+            "blocked": 0,
+            "blocked_users": [],
+            "failed": 0,
+            "errors": {},  # описание ошибки -> количество
+            "started": time.time()
+        }
+        self._save()
+        return self.state
+
+    def resume(self):
+        """Загрузка незавершённой рассылки. Возвращает состояние или None."""
+        if not os.path.exists(self.state_file):
+            return None
+        try:
+            with open(self.state_file, 'r') as f:
+                self.state = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"Не удалось прочитать состояние рассылки: {str(e)}")
+            return None
+        return self.state
+
+    def pending(self):
+        done = set(self.state["done"])
+        return [user_id for user_id in self.state["users"] if user_id not in done]
+
+    def run(self):
+        """Отправка всем, кому ещё не отправлено. Возвращает итоговое состояние."""
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for _ in executor.map(self._deliver, self.pending()):
+                pass
+        self._report(force=True)
+        if self.on_blocked is not None and self.state["blocked_users"]:
+            self.on_blocked(self.state["blocked_users"])
+        os.remove(self.state_file)
+        return self.state
+
+    def _deliver(self, user_id):
+        result, error = deliver(self.send, self.limiter, user_id, self.state["text"], self.max_retries)
+        with self._lock:
+            self.state["done"].append(user_id)
+            self.state[result] += 1
+            if result == "blocked":
+                self.state["blocked_users"].append(user_id)
+            if error and result == "failed":
+                self.state["errors"][error] = self.state["errors"].get(error, 0) + 1
+        self._report()
+
+    def _report(self, force=False):
+        with self._lock:
+            if not force and time.time() - self._last_saved < 3:
+                return
+            self._last_saved = time.time()
+            self._save()
+            state = dict(self.state)
+        if self.on_progress is not None:
+            try:
+                self.on_progress(state)
+            except Exception as e:
+                logging.error(f"Не удалось обновить прогресс рассылки: {str(e)}")
+
+    def _save(self):
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_file, self.state_file)
+
+
+def format_progress(state):
+    """Текст отчёта администратору о ходе рассылки."""
+    total = len(state["users"])
+    done = len(state["done"])
+    text = (
+        f"Рассылка: {done}/{total}\n"
+        f"✅ Доставлено: {state['sent']}\n"
+        f"🚫 Заблокировали бота: {state['blocked']}\n"
+        f"❌ Ошибки: {state['failed']}"
+    )
+    if done == total and state["errors"]:
+        common = Counter(state["errors"]).most_common(3)
+        text += "\n\nЧастые ошибки:\n" + "\n".join(f"{count} × {error}" for error, count in common)
+    return text
@@ -0,0 +1,196 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from schedule import NO_TEACHER, days
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _fold(line):
+    """Перенос строки iCalendar длиннее 75 байт (RFC 5545, 3.1)."""
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line
+    parts = []
+    while data:
+        size = 75 if not parts else 74
+        # Не разрываем многобайтовый символ UTF-8
+        while size < len(data) and (data[size] & 0xC0) == 0x80:
+            size -= 1
+        parts.append(data[:size].decode('utf-8'))
+        data = data[size:]
+    return "\r\n ".join(parts)
+
+
+def render_calendar(name, lessons, week_start):
+    """Календарь .ics с еженедельно повторяющимися парами, неделя начинается с week_start (понедельник)."""
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//bot2.0//schedule//RU",
+        "CALSCALE:GREGORIAN",
+        f"X-WR-CALNAME:{_escape(name)}"
+    ]
+    stamp = week_start.strftime("%Y%m%dT000000Z")
+    for lesson in lessons:
+        if '-' not in lesson.time:
+            continue
+        date = week_start + datetime.timedelta(days=days.index(lesson.day))
+        start, end = (datetime.datetime.strptime(part.strip(), "%H:%M").time() for part in lesson.time.split('-'))
+        description = f"Группа: {lesson.group}"
+        if lesson.teacher != NO_TEACHER:
+            description += f"\nПреподаватель: {lesson.teacher}"
+        uid = hashlib.blake2b(f"{name}|{lesson.group}|{lesson.day}|{lesson.pair}".encode('utf-8'), digest_size=8).hexdigest()
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{uid}@bot2.0",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART:{datetime.datetime.combine(date, start).strftime('%Y%m%dT%H%M%S')}",
+            f"DTEND:{datetime.datetime.combine(date, end).strftime('%Y%m%dT%H%M%S')}",
+            "RRULE:FREQ=WEEKLY",
+            f"SUMMARY:{_escape(lesson.subject)}",
+            f"LOCATION:{_escape(lesson.cabinet)}",
+            f"DESCRIPTION:{_escape(description)}",
+            "END:VEVENT"
+        ]
+    lines.append("END:VCALENDAR")
+    return ("\r\n".join(_fold(line) for line in lines) + "\r\n").encode('utf-8')
+
+
+class CalendarStore:
+    """Файлы .ics для каждой группы и преподавателя в каталоге directory.
+
+    При новой ревизии расписания (update) файл перезаписывается только у
+    тех, чьи пары изменились: в index.json хранится отпечаток пар каждого
+    календаря. Неделя week_start в отпечаток не входит: пары повторяются
+    еженедельно, и смена начальной недели сама по себе файлы не меняет.
+    Имена файлов — хэш названия, чтобы не зависеть от кириллицы и
+    спецсимволов в URL.
+
+    Календари пишет только главный процесс, процессы-обработчики перечитывают
+    index.json, когда он изменился. file_id, который Telegram вернул при
+    отправке файла, хранится рядом с файлом (файл.id) вместе с отпечатком
+    отправленной версии, поэтому его может записать любой процесс, а после
+    перегенерации файла старый file_id просто перестаёт подходить.
+    """
+
+    def __init__(self, directory, week_start):
+        self.directory = directory
+        self.week_start = week_start
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(directory, 'index.json')
+        self._index = {}  # "вид:название" -> {"file", "hash"}
+        self._index_mtime = None
+        os.makedirs(directory, exist_ok=True)
+        self._reload_index()
+
+    @staticmethod
+    def _key(kind, name):
+        return f"{kind}:{name}"
+
+    def update(self, schedule):
+        """Перегенерация изменившихся календарей. Возвращает число записанных файлов."""
+        entities = {}
+        for lesson in sorted(schedule.lessons.values(), key=lambda lesson: (days.index(lesson.day), lesson.pair)):
+            entities.setdefault(self._key("group", lesson.group), []).append(lesson)
+            if lesson.teacher != NO_TEACHER:
+                entities.setdefault(self._key("teacher", lesson.teacher), []).append(lesson)
+
+        written = 0
+        with self._lock:
+            for key, lessons in entities.items():
+                digest = hashlib.blake2b(
+                    json.dumps([list(lesson) for lesson in lessons], ensure_ascii=False).encode('utf-8'),
+                    digest_size=8
+                ).hexdigest()
+                entry = self._index.get(key)
+                file_name = f"{key.split(':', 1)[0]}-{hashlib.blake2b(key.encode('utf-8'), digest_size=6).hexdigest()}.ics"
+                path = os.path.join(self.directory, file_name)
+                if entry is not None and entry["hash"] == digest and os.path.exists(path):
+                    continue
+                tmp_path = path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(render_calendar(key.split(':', 1)[1], lessons, self.week_start))
+                os.replace(tmp_path, path)
+                self._index[key] = {"file": file_name, "hash": digest}
+                written += 1
+
+            for key in list(self._index):
+                if key not in entities:
+                    for suffix in ('', '.id'):
+                        try:
+                            os.remove(os.path.join(self.directory, self._index[key]["file"] + suffix))
+                        except OSError:
+                            pass
+                    del self._index[key]
+            self._save_index()
+        if written:
+            logging.info(f"Календари обновлены: {written} из {len(entities)}.")
+        return written
+
+    def _entry(self, kind, name):
+        with self._lock:
+            self._reload_index()
+            return self._index.get(self._key(kind, name))
+
+    def path(self, kind, name):
+        """Путь к файлу календаря или None, если его нет."""
+        entry = self._entry(kind, name)
+        return os.path.join(self.directory, entry["file"]) if entry else None
+
+    def digest(self, kind, name):
+        """Отпечаток текущей версии календаря или None."""
+        entry = self._entry(kind, name)
+        return entry["hash"] if entry else None
+
+    def file_id(self, kind, name):
+        """file_id Telegram для текущей версии файла или None, если её ещё не отправляли."""
+        entry = self._entry(kind, name)
+        if entry is None:
+            return None
+        try:
+            with open(os.path.join(self.directory, entry["file"] + '.id'), 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return saved["file_id"] if saved.get("hash") == entry["hash"] else None
+
+    def set_file_id(self, kind, name, file_id, digest):
+        """Запоминание file_id отправленной версии (digest — её отпечаток до отправки)."""
+        entry = self._entry(kind, name)
+        if entry is None or entry["hash"] != digest:
+            return
+        path = os.path.join(self.directory, entry["file"] + '.id')
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"hash": digest, "file_id": file_id}, f)
+        os.replace(tmp_path, path)
+
+    def _reload_index(self):
+        """Чтение index.json, если его изменил другой процесс."""
+        try:
+            mtime = os.path.getmtime(self._index_path)
+        except OSError:
+            return
+        if mtime == self._index_mtime:
+            return
+        try:
+            with open(self._index_path, 'r') as f:
+                self._index = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Не удалось прочитать {self._index_path}: {str(e)}")
+            return
+        self._index_mtime = mtime
+
+    def _save_index(self):
+        tmp_path = self._index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._index, f, ensure_ascii=False)
+        os.replace(tmp_path, self._index_path)
+        self._index_mtime = os.path.getmtime(self._index_path)
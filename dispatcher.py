@@ -0,0 +1,102 @@
+import logging
+import queue
+import threading
+import time
+
+import metrics
+
+
+def update_chat_id(update):
+    """Чат, к которому относится обновление Telegram, или None."""
+    if update.message:
+        return update.message.chat.id
+    if update.edited_message:
+        return update.edited_message.chat.id
+    if update.callback_query:
+        if update.callback_query.message:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+    if update.inline_query:
+        return update.inline_query.from_user.id
+    if update.chosen_inline_result:
+        return update.chosen_inline_result.from_user.id
+    if update.my_chat_member:
+        return update.my_chat_member.chat.id
+    return None
+
+
+class UpdateDispatcher:
+    """Параллельная обработка обновлений пулом потоков с порядком внутри чата.
+
+    Каждый чат закреплён за одним потоком (chat_id по модулю числа потоков),
+    поэтому сообщения одного чата обрабатываются строго по очереди и цепочки
+    register_next_step_handler не ломаются, а разные чаты идут параллельно.
+    У каждого потока своя ограниченная очередь. При переполнении overflow
+    определяет поведение: "block" — ждать места (приём новых обновлений
+    притормаживается), "drop" — отбросить обновление.
+
+    Если чаты уже поделены между процессами по chat_id % processes (см.
+    WorkerPool), в процессе передаётся stride=processes и поток выбирается
+    по chat_id // stride, иначе часть потоков не получала бы чатов.
+    """
+
+    def __init__(self, process, workers=4, queue_size=100, overflow="block", stride=1):
+        self.process = process  # функция, принимающая список обновлений
+        self.overflow = overflow
+        self.stride = stride
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._lock = threading.Lock()
+        self._stats = {
+            "processed": 0,
+            "dropped": 0,
+            "failed": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0
+        }
+        self._threads = []
+
+    def start(self):
+        for n, updates_queue in enumerate(self._queues):
+            thread = threading.Thread(target=self._work, args=(updates_queue,), name=f"dispatcher-{n}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, update):
+        """Постановка обновления в очередь потока, закреплённого за его чатом."""
+        chat_id = update_chat_id(update)
+        updates_queue = self._queues[((chat_id or 0) // self.stride) % len(self._queues)]
+        item = (time.time(), update)
+        if self.overflow == "drop":
+            try:
+                updates_queue.put_nowait(item)
+            except queue.Full:
+                with self._lock:
+                    self._stats["dropped"] += 1
+                logging.warning(f"Очередь обработки переполнена, обновление {update.update_id} отброшено.")
+        else:
+            updates_queue.put(item)
+
+    def stats(self):
+        """Счётчики обработки и времени ожидания в очереди."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["wait_avg"] = stats["wait_total"] / stats["processed"] if stats["processed"] else 0.0
+        stats["queued"] = [updates_queue.qsize() for updates_queue in self._queues]
+        return stats
+
+    def _work(self, updates_queue):
+        while True:
+            queued_at, update = updates_queue.get()
+            wait = time.time() - queued_at
+            metrics.observe('bot_queue_wait_seconds', wait)
+            try:
+                with metrics.trace(update.update_id), metrics.timer('bot_update_seconds'):
+                    self.process([update])
+            except Exception as e:
+                logging.error(f"Ошибка при обработке обновления {update.update_id}: {str(e)}")
+                with self._lock:
+                    self._stats["failed"] += 1
+            with self._lock:
+                self._stats["processed"] += 1
+                self._stats["wait_total"] += wait
+                self._stats["wait_max"] = max(self._stats["wait_max"], wait)
@@ -0,0 +1,176 @@
+"""Метрики в формате Prometheus и трассировка обработки обновлений.
+
+Счётчики и гистограммы хранятся в памяти процесса и отдаются текстом по
+GET /metrics (см. serve). Значения, которые проще прочитать на месте
+(размер очередей, число сессий), регистрируются через gauge как функции.
+
+Трассировка включается enable_tracing: на время обработки обновления
+(контекст trace) каждый timer запоминается как отрезок, и в конце в лог
+пишется одна строка со всеми отрезками и их длительностью.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_counters = {}    # (имя, метки) -> значение
+_histograms = {}  # (имя, метки) -> [счётчики по корзинам, сумма, количество]
+_gauges = {}      # имя -> (тип, функция)
+_local = threading.local()
+_tracing = False
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """Увеличение счётчика."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Добавление значения в гистограмму."""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+        for n, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[0][n] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+def gauge(name, callback, kind="gauge"):
+    """Регистрация значения, вычисляемого при каждом чтении /metrics."""
+    _gauges[name] = (kind, callback)
+
+
+@contextmanager
+def timer(name, **labels):
+    """Замер длительности блока в гистограмму name и отрезок текущей трассы."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        observe(name, elapsed, **labels)
+        spans = getattr(_local, "spans", None)
+        if spans is not None:
+            label = ",".join(str(value) for value in labels.values())
+            spans.append((f"{name}{{{label}}}" if label else name, elapsed))
+
+
+def enable_tracing(enabled=True):
+    global _tracing
+    _tracing = enabled
+
+
+@contextmanager
+def trace(update_id):
+    """Трасса обработки одного обновления, пишется в лог по завершении."""
+    if not _tracing:
+        yield
+        return
+    _local.spans = []
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        total = time.perf_counter() - started
+        spans = " ".join(f"{name}={elapsed * 1000:.1f}ms" for name, elapsed in _local.spans)
+        _local.spans = None
+        logging.info(f"trace update={update_id} total={total * 1000:.1f}ms {spans}")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus."""
+    lines = []
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: (list(value[0]), value[1], value[2]) for key, value in _histograms.items()}
+
+    seen = set()
+    for (name, labels), value in sorted(counters.items()):
+        if name not in seen:
+            lines.append(f"# TYPE {name} counter")
+            seen.add(name)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for (name, labels), (buckets, total, count) in sorted(histograms.items()):
+        if name not in seen:
+            lines.append(f"# TYPE {name} histogram")
+            seen.add(name)
+        for bound, bucket_count in zip(BUCKETS, buckets):
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {bucket_count}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    for name, (kind, callback) in sorted(_gauges.items()):
+        try:
+            value = callback()
+        except Exception as e:
+            logging.error(f"Не удалось вычислить метрику {name}: {str(e)}")
+            continue
+        lines.append(f"# TYPE {name} {kind}")
+        if isinstance(value, dict):
+            # {метки: значение}, метки — словарь или кортеж пар
+            for labels, labeled_value in value.items():
+                labels = tuple(sorted(dict(labels).items()))
+                lines.append(f"{name}{_format_labels(labels)} {labeled_value}")
+        else:
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def serve(host="127.0.0.1", port=9100, routes=None):
+    """Запуск HTTP-сервера с /metrics в фоновом потоке.
+
+    routes — дополнительные GET-обработчики: путь -> функция (параметры
+    запроса) -> (статус, content-type, тело).
+    """
+    routes = routes or {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == '/metrics':
+                status, content_type, body = 200, 'text/plain; version=0.0.4; charset=utf-8', render().encode('utf-8')
+            elif url.path in routes:
+                status, content_type, body = routes[url.path](dict(parse_qsl(url.query)))
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="metrics", daemon=True).start()
+    logging.info(f"Метрики доступны на http://{host}:{httpd.server_address[1]}/metrics")
+    return httpd
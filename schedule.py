@@ -0,0 +1,544 @@
+import re
+import sys
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+from sheet_grid import SheetGrid
+
+# Дни недели и время пар
+days = ["понедельник", "вторник", "среда", "четверг", "пятница", "суббота"]
+para_times = ['8:30-10:05', '10:15-11:50', '12:00-13:35', '14:15-15:50', '16:00-17:35', '17:45-19:20']
+saturday_para_times = ['8:30-10:05', '10:15-11:50', '12:00-13:35', '14:15-15:50']  # Время пар для субботы
+
+# Разметка листа по умолчанию: строка с курсами, строка с группами и первая
+# строка пар каждого дня. Используется, только если SheetLayout не нашёл
+# соответствующие заголовки на листе.
+COURSE_ROW = 1
+GROUP_ROW = 2
+day_layout = {
+    "понедельник": (5, para_times),
+    "вторник": (11, para_times),
+    "среда": (17, para_times),
+    "четверг": (23, para_times),
+    "пятница": (29, para_times),
+    "суббота": (35, saturday_para_times)
+}
+
+HEADER_ROWS = 10  # в скольких первых строках искать заголовки групп и курсов
+
+NO_TEACHER = "Преподаватель не указан"
+NO_CABINET = "Кабинет не указан"
+
+
+class Lesson:
+    """Одна пара одной группы.
+
+    Запись без __dict__, строки общие с таблицей строк листа (SheetGrid) и
+    интернированы, поэтому одинаковые предметы, ФИО и кабинеты во всех парах —
+    один объект. Поля перечисляются как у кортежа: list(lesson).
+    Сравнивается по идентичности: в одном расписании каждая пара — один объект.
+    """
+
+    __slots__ = ('group_col', 'group', 'day', 'pair', 'time', 'subject', 'teacher', 'cabinet')
+
+    def __init__(self, group_col, group, day, pair, time, subject, teacher, cabinet):
+        self.group_col = group_col
+        self.group = group
+        self.day = day
+        self.pair = pair
+        self.time = time
+        self.subject = subject
+        self.teacher = teacher
+        self.cabinet = cabinet
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return "Lesson(" + ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__) + ")"
+
+
+_token_split = re.compile(r'[^\w]+')
+
+
+def normalize(text):
+    """Приведение строки к нижнему регистру с заменой ё на е."""
+    return text.strip().lower().replace('ё', 'е')
+
+
+def name_tokens(text):
+    """Разбиение строки с ФИО на слова без инициалов."""
+    return [token for token in _token_split.split(normalize(text)) if len(token) > 1]
+
+
+def group_key(text):
+    """Название группы без регистра и разделителей: «ИВТ-101» -> «ивт101»."""
+    return "".join(_token_split.split(normalize(text)))
+
+
+def compact(text):
+    """Строка без пробелов в нижнем регистре: «П О Н Е Д Е Л Ь Н И К» -> «понедельник»."""
+    return "".join(normalize(text).split())
+
+
+# Транслитерация для поиска групп: «ИВТ-21», «ивт21» и «ivt21» дают один ключ
+_translit = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
+    'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh',
+    'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya'
+})
+
+
+def search_key(text):
+    """Ключ поиска группы: название латиницей без регистра и разделителей, «ИВТ-21» -> «ivt21»."""
+    return group_key(text).translate(_translit)
+
+
+_roman = {"i": 1, "ii": 2, "iii": 3, "iv": 4, "v": 5, "vi": 6}
+
+
+def course_number(text):
+    """Номер курса из подписи или запроса: «3 курс», «3», «III курс», «I I I   к у р с» -> 3."""
+    key = compact(text).replace("курс", "").strip("-.")
+    if key.isdecimal():
+        return int(key)
+    return _roman.get(key)
+
+
+# Сокращённые названия дней для поиска
+day_aliases = {"пн": "понедельник", "вт": "вторник", "ср": "среда", "чт": "четверг", "пт": "пятница", "сб": "суббота"}
+
+
+def find_day(word):
+    """День недели по слову запроса: полное название, его начало от трёх букв или сокращение."""
+    word = normalize(word)
+    if word in day_aliases:
+        return day_aliases[word]
+    if len(word) >= 3:
+        for day in days:
+            if day.startswith(word):
+                return day
+    return None
+
+
+def day_times(day):
+    """Время пар дня по номеру пары."""
+    return saturday_para_times if day == "суббота" else para_times
+
+
+def _minutes(text):
+    hours, minutes = text.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def current_pair(day, minutes):
+    """Номер идущей или ближайшей следующей пары дня по времени в минутах от полуночи, None — пары кончились."""
+    for pair, time in enumerate(day_times(day), start=1):
+        if minutes < _minutes(time.split('-')[1]):
+            return pair
+    return None
+
+
+def room_key(cabinet):
+    """Ключ сортировки кабинетов: номера по возрастанию, затем названия."""
+    digits = "".join(char for char in cabinet if char.isdecimal())
+    return (0, int(digits), cabinet) if digits else (1, 0, cabinet)
+
+
+def edit_distance(a, b, limit):
+    """Расстояние Левенштейна, при превышении limit возвращается limit + 1."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """Индекс слов из названий: поиск по началу слова и с опечатками.
+
+    Слова хранятся в отсортированном списке, поэтому поиск по префиксу —
+    это бинарный поиск и проход только по совпавшим словам. Для поиска с
+    опечатками кандидаты отбираются по общим триграммам и проверяются
+    расстоянием Левенштейна.
+    """
+
+    def __init__(self):
+        self.postings = {}  # слово -> [значение]
+        self._words = []
+        self._trigrams = {}  # триграмма -> {слово}
+
+    def add(self, text, value):
+        for token in set(name_tokens(text)):
+            self.postings.setdefault(token, []).append(value)
+
+    def freeze(self):
+        """Построение вспомогательных индексов после добавления всех слов."""
+        self._words = sorted(self.postings)
+        self._trigrams = {}
+        for word in self._words:
+            for gram in _trigrams(word):
+                self._trigrams.setdefault(gram, set()).add(word)
+
+    def prefix(self, word):
+        """Слова индекса, начинающиеся с word."""
+        found = []
+        for i in range(bisect_left(self._words, word), len(self._words)):
+            if not self._words[i].startswith(word):
+                break
+            found.append(self._words[i])
+        return found
+
+    def fuzzy(self, word):
+        """Слова индекса, отличающиеся от word (или от его начала) не более чем на 1–2 правки."""
+        limit = 1 if len(word) <= 5 else 2
+        counts = {}
+        for gram in _trigrams(word):
+            for candidate in self._trigrams.get(gram, ()):
+                counts[candidate] = counts.get(candidate, 0) + 1
+        needed = max(1, len(word) - 2 - 3 * limit)
+        found = []
+        for candidate, common in counts.items():
+            if common < needed:
+                continue
+            if edit_distance(word, candidate, limit) <= limit or \
+                    edit_distance(word, candidate[:len(word)], limit) <= limit:
+                found.append(candidate)
+        return found
+
+    def lookup(self, query):
+        """Значения, у которых каждое слово запроса совпадает с началом слова или похоже на слово.
+
+        Сначала ищется точное совпадение по префиксу, поиск с опечатками
+        включается только если по префиксу ничего не найдено.
+        """
+        words = name_tokens(query)
+        if not words:
+            return set()
+        for search in (self.prefix, self.fuzzy):
+            matched = None
+            for word in words:
+                found = set()
+                for token in search(word):
+                    found.update(self.postings[token])
+                matched = found if matched is None else matched & found
+                if not matched:
+                    break
+            if matched:
+                return matched
+        return set()
+
+
+def parse_lesson(raw, group_col, group, day, pair, time, cabinet):
+    """Разбор ячейки с парой. Пустая ячейка или «окно» — это отсутствие пары."""
+    if not raw or raw.lower() == "окно":
+        return None
+    lines = raw.split('\n')
+    subject = sys.intern(lines[0].strip())
+    teacher = sys.intern(" ".join(line.strip() for line in lines[1:] if line.strip())) or NO_TEACHER
+    return Lesson(group_col, group, day, pair, time, subject, teacher, cabinet or NO_CABINET)
+
+
+class SheetLayout:
+    """Координаты расписания на листе, найденные по заголовкам и объединённым ячейкам.
+
+    Строка групп — та, где есть колонки «№ пары», строка курсов — ближайшая
+    над ней строка с подписями «курс». Курс занимает колонки своей
+    объединённой ячейки (без объединения — до следующей подписи курса).
+    Дни ищутся по названиям в колонках левее первой группы, пары дня — это
+    строки под объединённой ячейкой дня (или до следующего дня) с номером в
+    колонке «№ пары». Чего не удалось найти, берётся из разметки по
+    умолчанию, и это записывается в warnings.
+
+    grid — SheetGrid, merges — объединения ячеек листа в формате GridRange
+    из Sheets API.
+    """
+
+    def __init__(self, grid, merges=()):
+        self.course_row = COURSE_ROW
+        self.group_row = GROUP_ROW
+        self.pair_cols = []  # колонки «№ пары»
+        self.groups = {}     # колонка -> название группы
+        self.courses = {}    # название курса -> [(колонка, группа)]
+        self.days = {}       # день -> [(строка, номер пары, время)]
+        self.warnings = []
+        # (строка, колонка) левого верхнего угла -> (конечная строка, конечная колонка)
+        self.merges = {
+            (merge.get('startRowIndex', 0), merge.get('startColumnIndex', 0)):
+                (merge.get('endRowIndex', 0), merge.get('endColumnIndex', 0))
+            for merge in merges
+        }
+        self._find_groups(grid)
+        self._find_courses(grid)
+        self._find_days(grid)
+
+    def _find_groups(self, grid):
+        for row_number in range(min(HEADER_ROWS, len(grid))):
+            pair_cols = grid.find(row_number, lambda cell: compact(cell) == "№пары")
+            if pair_cols:
+                self.group_row = row_number
+                self.pair_cols = pair_cols
+                break
+        else:
+            self.warnings.append(f"Колонки «№ пары» не найдены, строка групп {GROUP_ROW + 1} взята по умолчанию")
+        for col in grid.find(self.group_row, bool):
+            if col not in self.pair_cols:
+                self.groups[col] = grid.cell(self.group_row, col)
+
+    def _find_courses(self, grid):
+        for row_number in range(self.group_row - 1, -1, -1):
+            if grid.find(row_number, lambda cell: "курс" in compact(cell)):
+                self.course_row = row_number
+                break
+        else:
+            self.warnings.append(f"Подписи курсов не найдены, строка курсов {COURSE_ROW + 1} взята по умолчанию")
+        starts = [(col, grid.cell(self.course_row, col)) for col in grid.find(self.course_row, bool)]
+        last_col = max(self.groups, default=-1) + 1
+        for n, (start_col, label) in enumerate(starts):
+            merge = self.merges.get((self.course_row, start_col))
+            if merge is not None:
+                end_col = merge[1]
+            else:
+                end_col = starts[n + 1][0] if n + 1 < len(starts) else last_col
+            self.courses[label] = [(col, self.groups[col]) for col in range(start_col, end_col) if col in self.groups]
+
+    def _find_days(self, grid):
+        first_group = min(self.groups, default=1)
+        label_cols = range(0, min([first_group] + self.pair_cols))
+        labels = []  # (строка, колонка, день)
+        for row_number in range(self.group_row + 1, len(grid)):
+            for col in label_cols:
+                day = compact(grid.cell(row_number, col))
+                if day in days:
+                    labels.append((row_number, col, day))
+                    break
+
+        if not labels:
+            self.warnings.append("Названия дней не найдены, строки пар взяты по умолчанию")
+            for day, (first_row, times) in day_layout.items():
+                self.days[day] = [(first_row + i, i + 1, time) for i, time in enumerate(times)]
+            return
+
+        number_col = self.pair_cols[0] if self.pair_cols else None
+        for n, (first_row, col, day) in enumerate(labels):
+            merge = self.merges.get((first_row, col))
+            if merge is not None:
+                end_row = merge[0]
+            else:
+                end_row = labels[n + 1][0] if n + 1 < len(labels) else len(grid)
+            times = day_times(day)
+            rows = range(first_row, min(end_row, len(grid)))
+            pairs = []
+            if number_col is not None:
+                for row_number in rows:
+                    number = grid.cell(row_number, number_col)
+                    if number.isdecimal():
+                        pair = int(number)
+                        pairs.append((row_number, pair, times[pair - 1] if pair <= len(times) else ""))
+                if not pairs:
+                    self.warnings.append(f"В колонке «№ пары» для дня «{day}» нет номеров, пары взяты по порядку строк")
+            if not pairs:
+                pairs = [(row_number, i + 1, time) for i, (row_number, time) in enumerate(zip(rows, times))]
+            if not pairs:
+                self.warnings.append(f"Для дня «{day}» не найдено ни одной строки пар")
+            self.days[day] = pairs
+
+    def course_groups(self, course_label):
+        """Группы курса; подпись сравнивается без учёта пробелов и регистра,
+        а если так не нашлась — по номеру курса («3 курс» и «III курс»)."""
+        groups = self.courses.get(course_label)
+        if groups is None:
+            key = compact(course_label)
+            for label, label_groups in self.courses.items():
+                if compact(label) == key:
+                    return label_groups
+            number = course_number(course_label)
+            if number is not None:
+                for label, label_groups in self.courses.items():
+                    if course_number(label) == number:
+                        return label_groups
+        return groups
+
+
+class Schedule:
+    """Разобранное расписание с индексами по группе, преподавателю и кабинету.
+
+    Строится один раз на каждую новую версию данных листа, после чего все
+    запросы обработчиков сводятся к поиску по словарям.
+    """
+
+    def __init__(self, data, revision=None, merges=()):
+        grid = SheetGrid.from_rows(data)  # data — SheetGrid или список строк листа
+        self.revision = revision  # отпечаток данных листа, из которых построено расписание
+        self.layout = SheetLayout(grid, merges)
+        self.groups = self.layout.groups    # колонка -> название группы
+        self.courses = self.layout.courses  # название курса -> [(колонка, группа)]
+        self.lessons = {}     # (колонка, день, номер пары) -> Lesson
+        self.teachers = NameIndex()  # слова из ФИО -> Lesson
+        self.group_names = NameIndex()  # слова из названий групп -> колонка
+        self.by_cabinet = {}  # кабинет -> [Lesson]
+        self.occupancy = {}   # (кабинет, день, номер пары) -> [Lesson]
+
+        for day, pairs in self.layout.days.items():
+            for row_number, pair, time in pairs:
+                if row_number >= len(grid):
+                    break
+                for col, group in self.groups.items():
+                    lesson = parse_lesson(grid.cell(row_number, col), col, group, day, pair, time,
+                                          grid.cell(row_number, col + 1))
+                    if lesson is None:
+                        continue
+                    self.lessons[(col, day, pair)] = lesson
+                    self.teachers.add(lesson.teacher, lesson)
+                    if lesson.cabinet != NO_CABINET:
+                        self.by_cabinet.setdefault(lesson.cabinet, []).append(lesson)
+                        self.occupancy.setdefault((lesson.cabinet, day, pair), []).append(lesson)
+        self.teachers.freeze()
+        self._build_rooms()
+        self.group_cols = {group: col for col, group in self.groups.items()}  # название группы -> колонка
+        self.group_courses = {col: label for label, groups in self.courses.items() for col, _ in groups}
+        self.group_keys = NameIndex()  # ключ поиска (search_key) -> колонка
+        self._group_keys = {}  # колонка -> ключ поиска
+        for col, group in self.groups.items():
+            self.group_names.add(group, col)
+            self.group_keys.add(search_key(group), col)
+            self._group_keys[col] = search_key(group)
+        self.group_names.freeze()
+        self.group_keys.freeze()
+
+    def _build_rooms(self):
+        """Свободные кабинеты на каждую пару и накладки, один раз на ревизию.
+
+        Кабинет считается занятым двумя парами одновременно, только если в
+        нём в одно время разные предметы или преподаватели — общая лекция
+        нескольких групп накладкой не является.
+        """
+        self.rooms = sorted(self.by_cabinet, key=room_key)
+        self._free = {}  # (день, номер пары) -> [кабинет]
+        for day, pairs in self.layout.days.items():
+            for _, pair, _ in pairs:
+                self._free[(day, pair)] = [room for room in self.rooms if (room, day, pair) not in self.occupancy]
+        self.conflicts = sorted(
+            ((cabinet, day, pair, lessons) for (cabinet, day, pair), lessons in self.occupancy.items()
+             if len({(lesson.subject, lesson.teacher) for lesson in lessons}) > 1),
+            key=lambda item: (days.index(item[1]), item[2], room_key(item[0]))
+        )
+
+    def free_rooms(self, day, pair):
+        """Кабинеты, в которых нет занятий в указанную пару."""
+        return self._free.get((day, pair), [])
+
+    def groups_for_course(self, course_label):
+        """Группы курса в виде списка (колонка, название) или None, если курс не найден."""
+        return self.layout.course_groups(course_label)
+
+    def day_lessons(self, group_col, day):
+        """Пары группы за день: список длиной в число пар, None на месте окна."""
+        count = max((pair for _, pair, _ in self.layout.days.get(day, [])), default=0)
+        return [self.lessons.get((group_col, day, pair)) for pair in range(1, count + 1)]
+
+    def _key_prefix(self, key):
+        return {col for token in self.group_keys.prefix(key) for col in self.group_keys.postings[token]}
+
+    def find_groups(self, query):
+        """Колонки групп по запросу, точное совпадение названия первым.
+
+        Запрос сравнивается с ключом поиска названия («ИВТ-101», «ивт101» и
+        «ivt101» дают ivt101) по началу, затем по словам названия, затем с
+        опечатками в ключе.
+        """
+        key = search_key(query)
+        if not key:
+            return []
+        names = self._group_keys
+        cols = self._key_prefix(key) or self.group_names.lookup(query) or self.group_keys.lookup(key)
+        return sorted(cols, key=lambda col: (names[col] != key, self.groups[col], col))
+
+    def resolve_group(self, query):
+        """Колонка группы, которую запрос называет однозначно: всё название или
+        начало названия только одной группы. None — не найдена или подходит
+        несколько (варианты даёт find_groups)."""
+        key = search_key(query)
+        if not key:
+            return None
+        exact = self.group_keys.postings.get(key, [])
+        if len(exact) == 1:
+            return exact[0]
+        cols = self._key_prefix(key)
+        return cols.pop() if len(cols) == 1 else None
+
+    def teacher_lessons(self, query, day=None):
+        """Все пары преподавателя по фамилии, её началу или написанию с опечаткой."""
+        result = [lesson for lesson in self.teachers.lookup(query) if day is None or lesson.day == day]
+        result.sort(key=lambda lesson: (days.index(lesson.day), lesson.pair, lesson.group_col))
+        return result
+
+    def cabinet_lessons(self, cabinet):
+        """Все пары в кабинете."""
+        return self.by_cabinet.get(cabinet.strip(), [])
+
+    def changes_since(self, previous):
+        """Список (группа, день), расписание которых отличается от previous."""
+        def by_group_day(schedule):
+            result = {}
+            for lesson in schedule.lessons.values():
+                key = (lesson.group, lesson.day)
+                result.setdefault(key, set()).add((lesson.pair, lesson.subject, lesson.teacher, lesson.cabinet))
+            return result
+
+        old, new = by_group_day(previous), by_group_day(self)
+        changed = {key for key in old.keys() | new.keys() if old.get(key) != new.get(key)}
+        return sorted(changed, key=lambda key: (key[0], days.index(key[1])))
+
+
+class RenderCache:
+    """Готовые ответы (тексты и разметка) для текущей ревизии расписания.
+
+    Ключ — произвольный кортеж вроде ("day", колонка, день). При смене
+    ревизии кэш очищается целиком, при переполнении вытесняется давно не
+    использованная запись.
+    """
+
+    def __init__(self, max_entries=2000):
+        self.max_entries = max_entries
+        self.revision = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, revision, key, render):
+        """Значение из кэша или результат render(), который сохраняется."""
+        with self._lock:
+            if revision != self.revision:
+                self._entries.clear()
+                self.revision = revision
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = render()
+        with self._lock:
+            if revision == self.revision:
+                self._entries[key] = value
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
@@ -0,0 +1,85 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class SessionStore:
+    """Состояние диалога по chat_id с ограниченным сроком жизни и размером.
+
+    В памяти держится не больше max_sessions записей, давно не
+    использованные вытесняются, записи старше ttl считаются пустыми. Если
+    задан path, каждая запись сохраняется в SQLite: диалоги переживают
+    перезапуск, а вытесненная из памяти сессия читается из базы. Базу могут
+    использовать несколько процессов, при условии что каждый чат
+    обрабатывается одним процессом (иначе копия в памяти может устареть).
+    """
+
+    def __init__(self, ttl=86400, max_sessions=5000, path=None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # chat_id -> (время изменения, данные)
+        self._lock = threading.Lock()
+        self._db = None
+        self._last_cleanup = time.time()
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS sessions (chat_id INTEGER PRIMARY KEY, updated REAL, data TEXT)")
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, chat_id):
+        """Копия данных сессии, пустой словарь для новой или истёкшей."""
+        with self._lock:
+            return dict(self._get(chat_id))
+
+    def update(self, chat_id, **fields):
+        """Изменение полей сессии, поле со значением None удаляется."""
+        with self._lock:
+            data = dict(self._get(chat_id))
+            for key, value in fields.items():
+                if value is None:
+                    data.pop(key, None)
+                else:
+                    data[key] = value
+            self._put(chat_id, data)
+
+    def reset(self, chat_id, **fields):
+        """Начало новой сессии с указанными полями."""
+        with self._lock:
+            self._put(chat_id, {key: value for key, value in fields.items() if value is not None})
+
+    def _get(self, chat_id):
+        now = time.time()
+        record = self._sessions.get(chat_id)
+        if record is None and self._db is not None:
+            row = self._db.execute("SELECT updated, data FROM sessions WHERE chat_id = ?", (chat_id,)).fetchone()
+            if row is not None:
+                record = (row[0], json.loads(row[1]))
+                self._remember(chat_id, record)
+        if record is None or now - record[0] > self.ttl:
+            return {}
+        self._sessions.move_to_end(chat_id)
+        return record[1]
+
+    def _put(self, chat_id, data):
+        now = time.time()
+        self._remember(chat_id, (now, data))
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (chat_id, updated, data) VALUES (?, ?, ?)",
+                (chat_id, now, json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+            )
+            if now - self._last_cleanup > 3600:
+                self._db.execute("DELETE FROM sessions WHERE updated < ?", (now - self.ttl,))
+                self._last_cleanup = now
+
+    def _remember(self, chat_id, record):
+        self._sessions[chat_id] = record
+        self._sessions.move_to_end(chat_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
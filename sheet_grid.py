@@ -0,0 +1,92 @@
+import sys
+from array import array
+
+
+class SheetGrid:
+    """Значения листа в компактном виде: таблица строк и плотный массив ячеек.
+
+    Каждое уникальное значение хранится один раз (и интернируется), а ячейка —
+    это номер значения в таблице строк, записанный в array: 2 байта, пока
+    уникальных значений меньше 65536, иначе 4. Номер 0 — пустая ячейка.
+    Список списков строк из Google API занимает в несколько раз больше:
+    у каждой ячейки свой объект str и указатель в своей строке-списке.
+
+    Чтение только через методы, границы проверяются внутри:
+
+        grid.cell(row, col)   значение без пробелов по краям, "" — пусто или вне листа
+        grid.value(row, col)  значение как в таблице
+        grid.row(row)         значения строки без пустых ячеек в конце
+        grid.find(row, predicate)  колонки строки, значение которых подходит
+        len(grid), grid.cols  число строк и колонок
+        grid.to_rows()        список списков, как отдаёт values.get (для JSON)
+    """
+
+    __slots__ = ('rows', 'cols', 'strings', '_stripped', '_cells')
+
+    def __init__(self, strings, cells, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        self.strings = strings  # номер -> значение, strings[0] == ""
+        self._stripped = tuple(sys.intern(value.strip()) for value in strings)
+        self._cells = cells  # rows * cols номеров значений по строкам
+
+    @classmethod
+    def from_rows(cls, data):
+        """Компактная таблица из списка строк (или та же таблица, если она уже SheetGrid)."""
+        if isinstance(data, cls):
+            return data
+        rows = len(data)
+        cols = max((len(row) for row in data), default=0)
+        index = {"": 0}
+        strings = [""]
+        cells = array('I', bytes(4 * rows * cols))
+        for row_number, row in enumerate(data):
+            base = row_number * cols
+            for col, value in enumerate(row):
+                if not value:
+                    continue
+                number = index.get(value)
+                if number is None:
+                    number = index[value] = len(strings)
+                    strings.append(sys.intern(value))
+                cells[base + col] = number
+        if len(strings) <= 0xFFFF:
+            cells = array('H', cells)
+        return cls(tuple(strings), cells, rows, cols)
+
+    def __len__(self):
+        return self.rows
+
+    def _number(self, row, col):
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            return self._cells[row * self.cols + col]
+        return 0
+
+    def value(self, row, col):
+        return self.strings[self._number(row, col)]
+
+    def cell(self, row, col):
+        return self._stripped[self._number(row, col)]
+
+    def row(self, row):
+        if not 0 <= row < self.rows:
+            return []
+        numbers = self._cells[row * self.cols:(row + 1) * self.cols]
+        end = len(numbers)
+        while end and not numbers[end - 1]:
+            end -= 1
+        return [self.strings[number] for number in numbers[:end]]
+
+    def find(self, row, predicate):
+        """Колонки непустых ячеек строки, для значения (без пробелов по краям) которых predicate истинен."""
+        if not 0 <= row < self.rows:
+            return []
+        base = row * self.cols
+        return [col for col in range(self.cols)
+                if self._cells[base + col] and predicate(self._stripped[self._cells[base + col]])]
+
+    def to_rows(self):
+        rows = [self.row(row) for row in range(self.rows)]
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
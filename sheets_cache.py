@@ -0,0 +1,292 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+def _plain(value):
+    """Компактные таблицы (SheetGrid) пишутся в JSON списком строк, как их отдаёт API."""
+    if hasattr(value, 'to_rows'):
+        return value.to_rows()
+    raise TypeError(f"{type(value).__name__} не сериализуется в JSON")
+
+
+def fingerprint(data):
+    """Отпечаток содержимого диапазона, не меняется, пока не меняются значения ячеек."""
+    return hashlib.blake2b(json.dumps(data, ensure_ascii=False, default=_plain).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def read_snapshot(path):
+    """Записи снимка SheetCache.save_snapshot: {(spreadsheet_id, диапазон): запись}."""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        entries = json.load(f)
+    snapshot = {}
+    for saved in entries:
+        # Составные диапазоны хранятся в JSON списком, ключ кэша — кортеж
+        spreadsheet_id, range_name = saved["key"]
+        snapshot[(spreadsheet_id, tuple(range_name) if isinstance(range_name, list) else range_name)] = saved
+    return snapshot
+
+
+class SheetCache:
+    """Кэш значений диапазонов Google Sheets по ключу (spreadsheet_id, диапазон).
+
+    Записи обновляются фоновым потоком заранее, до истечения срока жизни,
+    а во время обновления запросы получают прежние данные. Синхронно
+    загружается только диапазон, которого ещё нет в кэше. Число записей
+    ограничено, при переполнении вытесняется давно не использованная.
+
+    Если содержимое при обновлении не изменилось (совпал отпечаток), в кэше
+    остаётся прежний объект данных, и зависящие от него разборы и индексы не
+    перестраиваются. Функция probe, если задана, дёшево возвращает версию
+    файла (например, время изменения из Drive) — при совпадении версии
+    диапазон не скачивается вовсе. Подписчики из add_listener вызываются
+    только при реальном изменении данных.
+    """
+
+    def __init__(self, fetch, ttl=300, max_entries=16, refresh_ahead=0.8, check_interval=5, probe=None, decode=None):
+        self.fetch = fetch  # функция (spreadsheet_id, range_name) -> значения
+        self.probe = probe  # функция (spreadsheet_id) -> версия файла
+        self.decode = decode  # функция (range_name, данные из снимка) -> значения, как их отдаёт fetch
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.refresh_ahead = refresh_ahead  # доля срока жизни, после которой запись обновляется
+        self.check_interval = check_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()  # клиент Google API не потокобезопасен
+        self._refresher = None
+        self._listeners = []
+
+    def get(self, spreadsheet_id, range_name, ttl=None):
+        """Значения диапазона. Устаревшие данные отдаются сразу, обновление идёт в фоне."""
+        key = (spreadsheet_id, range_name)
+        loading = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry["accessed"] = time.time()
+                if ttl is not None:
+                    entry["ttl"] = ttl
+                if self._is_due(entry):
+                    self._schedule_refresh(key, entry)
+                if entry["data"] is not None:
+                    metrics.inc('sheet_cache_requests_total', result='stale' if entry["refreshing"] else 'hit')
+                    return entry["data"]
+            else:
+                # Заглушка на время загрузки: остальные запросы ждут её, а не скачивают диапазон ещё раз
+                entry = self._store(key, None, ttl, timestamp=0)
+                entry["refreshing"] = True
+                entry["error"] = None
+                loading = True
+
+        if not loading:
+            # Диапазон уже загружается — ждём эту загрузку
+            entry["ready"].wait()
+            if entry["data"] is None:
+                raise entry.get("error") or RuntimeError(f"диапазон {key} не загружен")
+            return entry["data"]
+
+        # Диапазона нет в кэше — единственный случай синхронной загрузки
+        metrics.inc('sheet_cache_requests_total', result='miss')
+        try:
+            version, data = self._load(key)
+        except Exception as e:
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+            entry["error"] = e
+            entry["ready"].set()
+            raise
+        revision = fingerprint(data)
+        with self._lock:
+            entry["data"] = data
+            entry["revision"] = revision
+            entry["version"] = version
+            entry["timestamp"] = time.time()
+            entry["refreshing"] = False
+        entry["ready"].set()
+        self._notify(key, entry)
+        return data
+
+    def revision(self, spreadsheet_id, range_name):
+        """Отпечаток текущих данных диапазона или None, если диапазон не загружен."""
+        with self._lock:
+            entry = self._entries.get((spreadsheet_id, range_name))
+            return entry["revision"] if entry is not None else None
+
+    def age(self, spreadsheet_id, range_name):
+        """Сколько секунд назад данные диапазона были успешно загружены, 0 — если не загружен."""
+        with self._lock:
+            entry = self._entries.get((spreadsheet_id, range_name))
+            if entry is None or entry["data"] is None:
+                return 0
+            return time.time() - entry["timestamp"]
+
+    def expires_in(self, spreadsheet_id, range_name):
+        """Сколько секунд данные диапазона ещё не будут обновляться, 0 — если не загружен."""
+        with self._lock:
+            entry = self._entries.get((spreadsheet_id, range_name))
+            if entry is None or entry["data"] is None:
+                return 0
+            return max(0.0, entry["timestamp"] + entry["ttl"] * self.refresh_ahead - time.time())
+
+    def save_snapshot(self, path):
+        """Запись всех загруженных диапазонов на диск (JSON, сжатый gzip)."""
+        with self._lock:
+            entries = [
+                {"key": list(key), "data": entry["data"], "revision": entry["revision"],
+                 "version": entry["version"], "timestamp": entry["timestamp"]}
+                for key, entry in self._entries.items() if entry["data"] is not None
+            ]
+        tmp_path = path + '.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False, separators=(',', ':'), default=_plain)
+        os.replace(tmp_path, path)
+
+    def load_snapshot(self, path):
+        """Заполнение кэша из снимка. Записи сохраняют старое время загрузки
+        и отдаются сразу, а фоновый поток обновляет их как устаревшие."""
+        if not os.path.exists(path):
+            return 0
+        try:
+            entries = read_snapshot(path)
+        except (OSError, ValueError) as e:
+            logging.error(f"Не удалось прочитать снимок {path}: {str(e)}")
+            return 0
+        with self._lock:
+            for key, saved in entries.items():
+                data = self.decode(key[1], saved["data"]) if self.decode is not None else saved["data"]
+                entry = self._store(key, data, None, timestamp=saved["timestamp"])
+                entry["revision"] = saved["revision"]
+                entry["version"] = saved["version"]
+        logging.info(f"Из снимка {path} загружено диапазонов: {len(entries)}.")
+        return len(entries)
+
+    def add_listener(self, listener):
+        """Подписка на изменение данных: listener(spreadsheet_id, range_name, data, revision)."""
+        self._listeners.append(listener)
+
+    def load(self, spreadsheet_id, range_name):
+        """Загрузка диапазона мимо кэша (например, для проверки перед put)."""
+        with self._fetch_lock:
+            return self.fetch(spreadsheet_id, range_name)
+
+    def put(self, spreadsheet_id, range_name, data, ttl=None):
+        """Запись уже загруженных данных как свежих. Подписчики не вызываются.
+
+        Если в кэше уже лежит этот же объект данных (взятый через peek),
+        сохраняются его время загрузки и версия: старые данные не становятся
+        свежими, и фоновый поток обновит их как обычно.
+        """
+        key = (spreadsheet_id, range_name)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and cached["data"] is data:
+                entry = self._store(key, data, ttl, timestamp=cached["timestamp"])
+                entry["version"] = cached["version"]
+            else:
+                entry = self._store(key, data, ttl)
+        return entry["revision"]
+
+    def peek(self, spreadsheet_id, range_name):
+        """Данные диапазона, если они есть в кэше, без загрузки и обновления."""
+        with self._lock:
+            entry = self._entries.get((spreadsheet_id, range_name))
+            return entry["data"] if entry is not None else None
+
+    def start(self):
+        """Запуск фонового потока, обновляющего записи до истечения их срока."""
+        if self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_loop, name="sheet-cache", daemon=True)
+            self._refresher.start()
+
+    def _is_due(self, entry):
+        return time.time() - entry["timestamp"] >= entry["ttl"] * self.refresh_ahead and not entry["refreshing"]
+
+    def _store(self, key, data, ttl, timestamp=None):
+        now = time.time()
+        entry = {
+            "data": data,
+            "revision": fingerprint(data) if data is not None else None,
+            "version": None,
+            "timestamp": now if timestamp is None else timestamp,
+            "ttl": ttl if ttl is not None else self.ttl,
+            "accessed": now,
+            "refreshing": False,
+            "ready": threading.Event()
+        }
+        if data is not None:
+            entry["ready"].set()
+        self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            logging.info(f"Диапазон {evicted} вытеснен из кэша.")
+        return entry
+
+    def _load(self, key, known_version=None):
+        """Загрузка диапазона. Возвращает (версия, данные), данные None — версия не изменилась."""
+        with self._fetch_lock:
+            version = None
+            if self.probe is not None:
+                try:
+                    version = self.probe(key[0])
+                except Exception as e:
+                    logging.error(f"Не удалось получить версию таблицы {key[0]}: {str(e)}")
+                if version is not None and version == known_version:
+                    return version, None
+            return version, self.fetch(*key)
+
+    def _notify(self, key, entry):
+        for listener in self._listeners:
+            try:
+                listener(key[0], key[1], entry["data"], entry["revision"])
+            except Exception as e:
+                logging.error(f"Ошибка обработчика изменения диапазона {key}: {str(e)}")
+
+    def _schedule_refresh(self, key, entry):
+        entry["refreshing"] = True
+        threading.Thread(target=self._refresh, args=(key, entry), daemon=True).start()
+
+    def _refresh(self, key, entry):
+        try:
+            version, data = self._load(key, entry["version"])
+        except Exception as e:
+            logging.error(f"Не удалось обновить диапазон {key}: {str(e)}")
+            with self._lock:
+                entry["refreshing"] = False
+            entry["ready"].set()
+            return
+        changed = False
+        with self._lock:
+            # Запись могла быть удалена или вытеснена, пока шла загрузка
+            if self._entries.get(key) is entry:
+                entry["timestamp"] = time.time()
+                entry["version"] = version
+                revision = fingerprint(data) if data is not None else entry["revision"]
+                if revision != entry["revision"] or entry["data"] is None:
+                    entry["data"] = data
+                    entry["revision"] = revision
+                    changed = True
+            entry["refreshing"] = False
+        entry["ready"].set()
+        if changed:
+            logging.info(f"Данные диапазона {key} изменились, новая ревизия {entry['revision']}.")
+            self._notify(key, entry)
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.check_interval)
+            now = time.time()
+            with self._lock:
+                for key, entry in list(self._entries.items()):
+                    # Обновляем заранее только то, что спрашивали в пределах нескольких сроков жизни
+                    if self._is_due(entry) and now - entry["accessed"] < entry["ttl"] * 3:
+                        self._schedule_refresh(key, entry)
@@ -0,0 +1,109 @@
+import logging
+import random
+import threading
+import time
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+import metrics
+
+# Ответы Google API, после которых имеет смысл повторить запрос
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    """Запрос не выполнялся: API недоступно, автомат разомкнут."""
+
+
+def is_retryable(error):
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUSES
+    # Таймауты и сетевые ошибки (socket.timeout, ssl.SSLError — подклассы OSError)
+    return isinstance(error, (OSError, httplib2.HttpLib2Error))
+
+
+class CircuitBreaker:
+    """Автомат отключения: после failure_threshold ошибок подряд запросы не
+    выполняются reset_timeout секунд, затем пропускается один пробный.
+    Успешный пробный запрос замыкает автомат, неудачный — снова размыкает.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return self.state == self.CLOSED
+
+    def success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logging.info("Google Sheets снова доступен, автомат замкнут.")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                logging.warning(f"Google Sheets недоступен ({self.failures} ошибок подряд), "
+                                f"запросы приостановлены на {self.reset_timeout} с.")
+
+
+class SheetsClient:
+    """Выполнение запросов Google API с повторами, общим сроком и автоматом отключения.
+
+    Повторяются только временные ошибки (сеть, таймаут, 429 и 5xx) с
+    экспоненциальной задержкой и случайным разбросом, чтобы перезапущенные
+    экземпляры не били в API одновременно. Все попытки одного вызова
+    укладываются в deadline секунд: следующая попытка начинается, только если
+    и задержка, и её полный таймаут attempt_timeout успевают до срока. Сам
+    таймаут задаётся у httplib2.Http, через который построен сервис (см. bot.py).
+    """
+
+    def __init__(self, deadline=30, attempts=4, base_delay=0.5, max_delay=8, breaker=None, attempt_timeout=0):
+        self.deadline = deadline
+        self.attempts = attempts
+        self.attempt_timeout = attempt_timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+
+    def execute(self, request, method):
+        """Выполнение запроса googleapiclient. method — имя для метрик и журнала."""
+        started = time.monotonic()
+        for attempt in range(self.attempts):
+            if not self.breaker.allow():
+                metrics.inc('sheets_requests_total', method=method, result='circuit_open')
+                raise CircuitOpenError(f"Google Sheets недоступен, запрос {method} не выполнялся")
+            try:
+                result = request.execute(num_retries=0)
+            except Exception as e:
+                if not is_retryable(e):
+                    # Ошибка запроса (неверный ID, нет доступа) — API при этом работает
+                    self.breaker.success()
+                    raise
+                self.breaker.failure()
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+                remaining = self.deadline - (time.monotonic() - started)
+                if attempt + 1 == self.attempts or delay + self.attempt_timeout > remaining:
+                    raise
+                logging.warning(f"Ошибка запроса {method} ({str(e)}), повтор через {delay:.1f} с.")
+                metrics.inc('sheets_retries_total', method=method)
+                time.sleep(delay)
+            else:
+                self.breaker.success()
+                return result
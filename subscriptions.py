@@ -0,0 +1,171 @@
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from broadcast import deliver
+
+
+class SubscriptionStore:
+    """Подписки на ежедневное расписание в SQLite: чат, группа и время отправки.
+
+    Группа хранится по названию, а не по колонке, чтобы подписка пережила
+    перестановку колонок в таблице. В push_log записывается дата последней
+    отправки каждого времени, чтобы после перезапуска не отправить повторно.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS subscriptions ("
+            "chat_id INTEGER PRIMARY KEY, group_name TEXT NOT NULL, send_time TEXT NOT NULL, created REAL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS push_log (send_time TEXT PRIMARY KEY, date TEXT NOT NULL)")
+
+    def subscribe(self, chat_id, group, send_time):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO subscriptions (chat_id, group_name, send_time, created) VALUES (?, ?, ?, ?)",
+                (chat_id, group, send_time, time.time())
+            )
+
+    def unsubscribe(self, chat_ids):
+        """Удаление подписок. Возвращает число удалённых."""
+        with self._lock:
+            self._db.execute("BEGIN")
+            removed = sum(
+                self._db.execute("DELETE FROM subscriptions WHERE chat_id = ?", (int(chat_id),)).rowcount
+                for chat_id in chat_ids
+            )
+            self._db.execute("COMMIT")
+        return removed
+
+    def get(self, chat_id):
+        """(группа, время) подписки чата или None."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT group_name, send_time FROM subscriptions WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM subscriptions").fetchone()[0]
+
+    def send_times(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT DISTINCT send_time FROM subscriptions ORDER BY send_time")]
+
+    def by_group(self, send_time):
+        """Подписчики на время send_time, сгруппированные по группе: {группа: [chat_id]}."""
+        groups = {}
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT group_name, chat_id FROM subscriptions WHERE send_time = ?", (send_time,)
+            ).fetchall()
+        for group, chat_id in rows:
+            groups.setdefault(group, []).append(chat_id)
+        return groups
+
+    def last_push(self, send_time):
+        with self._lock:
+            row = self._db.execute("SELECT date FROM push_log WHERE send_time = ?", (send_time,)).fetchone()
+        return row[0] if row else None
+
+    def mark_pushed(self, send_time, date):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO push_log (send_time, date) VALUES (?, ?)", (send_time, date))
+
+
+def parse_time(text):
+    """Время вида «20:00» в нормализованном виде «20:00» или None."""
+    try:
+        parsed = datetime.datetime.strptime(text.strip(), "%H:%M")
+    except ValueError:
+        return None
+    return parsed.strftime("%H:%M")
+
+
+class DailyPush:
+    """Ежедневная отправка расписания на завтра подписчикам.
+
+    Раз в check_interval секунд проверяется, наступило ли время какой-либо
+    подписки. Подписчики одного времени группируются по группе, текст для
+    группы готовит render(группа, дата) один раз, после чего сообщения
+    отправляются через общий RateLimiter несколькими потоками. Если бот был
+    выключен во время отправки, она выполняется после запуска, но не позже
+    catch_up секунд после назначенного времени. Отправка отмечается в
+    push_log до начала, поэтому сбой посреди отправки не приводит к повторам.
+    """
+
+    def __init__(self, store, render, send, limiter, workers=8, on_blocked=None, check_interval=30, catch_up=3600):
+        self.store = store
+        self.render = render  # функция (группа, дата) -> текст или None, если пар нет
+        self.send = send  # функция (chat_id, text)
+        self.limiter = limiter
+        self.workers = workers
+        self.on_blocked = on_blocked  # функция (список chat_id, заблокировавших бота)
+        self.check_interval = check_interval
+        self.catch_up = catch_up
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="daily-push", daemon=True)
+            self._thread.start()
+
+    def due(self, now=None):
+        """Времена подписок, отправка которых назначена и ещё не выполнена сегодня."""
+        now = now or datetime.datetime.now()
+        today = now.date().isoformat()
+        result = []
+        for send_time in self.store.send_times():
+            hour, minute = map(int, send_time.split(':'))
+            scheduled = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if 0 <= (now - scheduled).total_seconds() < self.catch_up and self.store.last_push(send_time) != today:
+                result.append(send_time)
+        return result
+
+    def push(self, send_time, date):
+        """Отправка расписания на дату date подписчикам времени send_time. Возвращает счётчики."""
+        messages = []
+        for group, chat_ids in self.store.by_group(send_time).items():
+            try:
+                text = self.render(group, date)
+            except Exception as e:
+                logging.error(f"Не удалось подготовить расписание группы {group}: {str(e)}")
+                continue
+            if text:
+                messages.extend((chat_id, text) for chat_id in chat_ids)
+
+        stats = {"sent": 0, "blocked": 0, "failed": 0}
+        blocked = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(deliver, self.send, self.limiter, chat_id, text) for chat_id, text in messages]
+            for (chat_id, _), future in zip(messages, futures):
+                result, _ = future.result()
+                stats[result] += 1
+                if result == "blocked":
+                    blocked.append(chat_id)
+        if blocked:
+            self.store.unsubscribe(blocked)
+            if self.on_blocked is not None:
+                self.on_blocked(blocked)
+        logging.info(f"Расписание на {date} в {send_time}: отправлено {stats['sent']}, "
+                     f"заблокировали {stats['blocked']}, ошибок {stats['failed']}.")
+        return stats
+
+    def _loop(self):
+        while True:
+            now = datetime.datetime.now()
+            for send_time in self.due(now):
+                self.store.mark_pushed(send_time, now.date().isoformat())
+                try:
+                    self.push(send_time, now.date() + datetime.timedelta(days=1))
+                except Exception as e:
+                    logging.error(f"Ошибка отправки расписания подписчикам в {send_time}: {str(e)}")
+            time.sleep(self.check_interval)
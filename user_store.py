@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+class UserStore:
+    """Пользователи бота в SQLite (режим WAL) с копией ID в памяти.
+
+    Проверка «есть ли пользователь» выполняется по словарю в памяти, в базу
+    пишутся только новые пользователи и смена флага blocked. Флаг blocked
+    ставит главный процесс по ответам рассылки, поэтому «снова активен»
+    проверяется по базе, а не только по словарю. Подсчёт и
+    список для рассылки читаются из базы: с несколькими процессами словарь
+    каждого из них видит только своих новых пользователей.
+    При первом запуске пользователи переносятся из старого users.json.
+    """
+
+    def __init__(self, path, legacy_json=None):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "user_id TEXT PRIMARY KEY, first_seen REAL, username TEXT, "
+            "first_name TEXT, last_name TEXT, blocked INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._blocked = dict(self._db.execute("SELECT user_id, blocked FROM users"))  # user_id -> 0/1
+        if legacy_json and os.path.exists(legacy_json):
+            self._migrate(legacy_json)
+
+    def __contains__(self, user_id):
+        return str(user_id) in self._blocked
+
+    def add(self, user_id, username=None, first_name=None, last_name=None):
+        """Добавление пользователя. Возвращает True, если он новый или снова активен."""
+        user_id = str(user_id)
+        state = self._blocked.get(user_id)
+        with self._lock:
+            if state == 0:
+                # Флаг мог выставить другой процесс (рассылка идёт в главном), поэтому
+                # проверяем базу: запрос ничего не меняет, если пользователь не заблокирован
+                return self._db.execute(
+                    "UPDATE users SET blocked = 0 WHERE user_id = ? AND blocked = 1", (user_id,)
+                ).rowcount > 0
+            if state is None:
+                self._db.execute(
+                    "INSERT OR IGNORE INTO users (user_id, first_seen, username, first_name, last_name) VALUES (?, ?, ?, ?, ?)",
+                    (user_id, time.time(), username, first_name, last_name)
+                )
+            else:
+                # Пользователь снова написал боту — возвращаем его в рассылки
+                self._db.execute("UPDATE users SET blocked = 0 WHERE user_id = ?", (user_id,))
+            self._blocked[user_id] = 0
+        return True
+
+    def set_blocked(self, user_ids, blocked=True):
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "UPDATE users SET blocked = ? WHERE user_id = ?",
+                [(int(blocked), str(user_id)) for user_id in user_ids]
+            )
+            self._db.execute("COMMIT")
+            for user_id in user_ids:
+                if str(user_id) in self._blocked:
+                    self._blocked[str(user_id)] = int(blocked)
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def count_blocked(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM users WHERE blocked = 1").fetchone()[0]
+
+    def active_ids(self):
+        """ID пользователей, не заблокировавших бота."""
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT user_id FROM users WHERE blocked = 0")]
+
+    def _migrate(self, legacy_json):
+        """Одноразовый перенос пользователей из users.json."""
+        try:
+            with open(legacy_json, 'r') as f:
+                user_data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"Не удалось прочитать {legacy_json} для переноса: {str(e)}")
+            return
+        rows = [
+            (user_id, info.get("first_seen"), info.get("username"), info.get("first_name"),
+             info.get("last_name"), int(bool(info.get("blocked"))))
+            for user_id, info in user_data.items()
+        ]
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT OR IGNORE INTO users VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._db.execute("COMMIT")
+            self._blocked = dict(self._db.execute("SELECT user_id, blocked FROM users"))
+        os.replace(legacy_json, legacy_json + '.migrated')
+        logging.info(f"Перенесено пользователей из {legacy_json}: {len(rows)}.")
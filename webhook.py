@@ -0,0 +1,94 @@
+import hmac
+import json
+import logging
+import secrets
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+
+class WebhookServer:
+    """Встроенный HTTP-сервер для приёма обновлений Telegram через webhook.
+
+    POST-запрос на path с заголовком X-Telegram-Bot-Api-Secret-Token
+    разбирается в types.Update и передаётся в submit. Ответ 200 отправляется
+    сразу, обработка идёт в диспетчере. Для локальной проверки достаточно
+    отправить записанный JSON обновления:
+
+        curl -X POST -H "X-Telegram-Bot-Api-Secret-Token: <секрет>" \\
+             --data @update.json http://127.0.0.1:8443/webhook
+
+    Без секрета обновления не принимаются: если secret_token не задан,
+    генерируется случайный, и его нужно передать в setWebhook. Секрет
+    проверяется до чтения тела, тело длиннее max_body не читается (413),
+    а соединение, молчащее дольше timeout секунд, закрывается.
+    """
+
+    def __init__(self, submit, host="0.0.0.0", port=8443, path="/webhook", secret_token="",
+                 max_body=1024 * 1024, timeout=10):
+        self.submit = submit
+        self.path = path
+        self.secret_token = secret_token or secrets.token_urlsafe(32)
+        self.max_body = max_body
+        self.timeout = timeout
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+
+    def serve_forever(self):
+        host, port = self.httpd.server_address[:2]
+        logging.info(f"Webhook-сервер слушает {host}:{port}{self.path}")
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def handle_update(self, headers, rfile):
+        """Проверка секрета, чтение и разбор обновления. Возвращает HTTP-статус ответа."""
+        received = headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not hmac.compare_digest(received.encode('utf-8'), self.secret_token.encode('utf-8')):
+            return 403
+        try:
+            length = int(headers.get('Content-Length', ''))
+        except ValueError:
+            return 400
+        if length < 0:
+            return 400
+        if length > self.max_body:
+            return 413
+        try:
+            payload = json.loads(rfile.read(length).decode('utf-8'))
+            if not isinstance(payload, dict):
+                raise ValueError("обновление должно быть JSON-объектом")
+            update = types.Update.de_json(payload)
+        except (ValueError, KeyError, TypeError) as e:
+            logging.error(f"Не удалось разобрать обновление из webhook: {str(e)}")
+            return 400
+        self.submit(update)
+        return 200
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            timeout = server.timeout
+
+            def do_POST(self):
+                if self.path != server.path:
+                    self._reply(404)
+                    return
+                self._reply(server.handle_update(self.headers, self.rfile))
+
+            def _reply(self, status, content_type="text/plain; charset=utf-8", body=b""):
+                if status != 200:
+                    # Тело запроса могло остаться непрочитанным
+                    self.close_connection = True
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(f"{self.address_string()} {format % args}")
+
+        return Handler
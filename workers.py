@@ -0,0 +1,152 @@
+import logging
+import os
+import queue
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+from dispatcher import update_chat_id
+
+
+class WorkerPool:
+    """Процессы-обработчики, между которыми обновления делятся по chat_id.
+
+    Главный процесс получает обновления (polling или webhook) и передаёт
+    каждое процессу номер chat_id % processes через локальное соединение
+    multiprocessing.connection. Поэтому все сообщения чата обрабатывает один
+    процесс, и его сессия в памяти не расходится с базой. Обработчики
+    запускаются командой command с переменными окружения BOT_PROCESS=worker,
+    BOT_WORKER_NUMBER и адресом для подключения. Упавший процесс
+    перезапускается, а накопившиеся для него обновления ждут в очереди.
+    Обработчик сообщает update_id каждого обработанного обновления, после
+    чего вызывается on_done. Остальное, что обработчик присылает по тому же
+    соединению (кортеж), передаётся в on_message — так главному процессу
+    поручается работа, которая должна идти в одном месте (например, рассылка).
+    """
+
+    def __init__(self, command, processes=2, queue_size=1000, host="127.0.0.1", on_done=None, on_message=None):
+        self.command = command
+        self.processes = processes
+        self.on_done = on_done
+        self.on_message = on_message
+        self._authkey = secrets.token_bytes(16)
+        self._listener = Listener((host, 0), authkey=self._authkey)
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(processes)]
+        self._children = [None] * processes
+        self._stats = {"sent": 0, "processed": 0, "restarts": 0}
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def start(self):
+        for number in range(self.processes):
+            self._spawn(number)
+        threading.Thread(target=self._accept, name="worker-accept", daemon=True).start()
+        threading.Thread(target=self._watch, name="worker-watch", daemon=True).start()
+
+    def stop(self):
+        """Остановка процессов-обработчиков."""
+        self._stopped = True
+        for child in self._children:
+            if child is not None and child.poll() is None:
+                child.terminate()
+        for child in self._children:
+            if child is not None:
+                child.wait()
+
+    def submit(self, update):
+        """Постановка обновления в очередь процесса, закреплённого за его чатом."""
+        self._queues[(update_chat_id(update) or 0) % self.processes].put(update)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queued"] = [updates_queue.qsize() for updates_queue in self._queues]
+        stats["alive"] = sum(child is not None and child.poll() is None for child in self._children)
+        return stats
+
+    def _spawn(self, number):
+        host, port = self._listener.address
+        env = dict(os.environ)
+        env.update({
+            "BOT_PROCESS": "worker",
+            "BOT_WORKER_NUMBER": str(number),
+            "BOT_WORKER_ADDRESS": f"{host}:{port}",
+            "BOT_WORKER_AUTHKEY": self._authkey.hex()
+        })
+        self._children[number] = subprocess.Popen(self.command, env=env)
+        logging.info(f"Запущен процесс-обработчик {number} (pid {self._children[number].pid}).")
+
+    def _accept(self):
+        while True:
+            try:
+                connection = self._listener.accept()
+                number = connection.recv()
+            except Exception as e:
+                logging.error(f"Не удалось принять подключение процесса-обработчика: {str(e)}")
+                continue
+            threading.Thread(target=self._send, args=(number, connection), name=f"worker-send-{number}", daemon=True).start()
+            threading.Thread(target=self._receive, args=(connection,), name=f"worker-receive-{number}", daemon=True).start()
+
+    def _send(self, number, connection):
+        """Передача обновлений процессу, пока соединение живо."""
+        updates_queue = self._queues[number]
+        while True:
+            update = updates_queue.get()
+            try:
+                connection.send(update)
+            except (OSError, EOFError) as e:
+                # Обновление вернётся в очередь и уйдёт перезапущенному процессу
+                logging.error(f"Соединение с процессом-обработчиком {number} потеряно: {str(e)}")
+                updates_queue.put(update)
+                connection.close()
+                return
+            with self._lock:
+                self._stats["sent"] += 1
+
+    def _receive(self, connection):
+        """Приём от процесса номеров обработанных обновлений и поручений."""
+        while True:
+            try:
+                update_id = connection.recv()
+            except (OSError, EOFError):
+                return
+            if not isinstance(update_id, int):
+                if self.on_message is not None:
+                    try:
+                        self.on_message(update_id)
+                    except Exception as e:
+                        logging.error(f"Ошибка обработки сообщения процесса-обработчика: {str(e)}")
+                continue
+            with self._lock:
+                self._stats["processed"] += 1
+            if self.on_done is not None:
+                self.on_done(update_id)
+
+    def _watch(self):
+        while True:
+            time.sleep(5)
+            if self._stopped:
+                return
+            for number, child in enumerate(self._children):
+                if child.poll() is not None:
+                    logging.error(f"Процесс-обработчик {number} завершился с кодом {child.returncode}, перезапуск.")
+                    with self._lock:
+                        self._stats["restarts"] += 1
+                    self._spawn(number)
+
+
+def worker_connection():
+    """Подключение процесса-обработчика к главному процессу. Возвращает (номер, соединение)."""
+    number = int(os.environ["BOT_WORKER_NUMBER"])
+    host, port = os.environ["BOT_WORKER_ADDRESS"].rsplit(':', 1)
+    connection = Client((host, int(port)), authkey=bytes.fromhex(os.environ["BOT_WORKER_AUTHKEY"]))
+    connection.send(number)
+    return number, connection
+
+
+def worker_command(script):
+    """Команда запуска процесса-обработчика тем же интерпретатором."""
+    return [sys.executable, os.path.abspath(script)]